@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+ROS Query API - answers filtered dashboard queries from in-memory indexes
+Started with `python ros_data_processor.py serve`; binds to loopback only
+"""
+
+import asyncio
+import json
+from datetime import date
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+from ros_dense_facts import DenseFacts
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Sections of the dashboard JSON that the API answers per query instead of shipping
+HEAVY_SECTIONS = ('per_restaurant_daily', 'reconciliation_daily', 'banking_variance_daily', 'rollup_cube',
+                  'dimensions', 'format_version')
+SUM_COLUMNS = ['orders', 'revenue', 'expenses',
+               'food_payment', 'drinks_payment', 'other_payment', 'service_charges', 'delivery_charges',
+               'bills', 'vendors', 'wage_advance', 'repairs', 'sundries']
+_EPOCH = date(1970, 1, 1)
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _day_param(query, name):
+    """ISO date query parameter as a day key (days since 1970-01-01), or None"""
+    value = query.get(name, [''])[0]
+    if not value:
+        return None
+    try:
+        return (date.fromisoformat(value) - _EPOCH).days
+    except ValueError:
+        raise BadRequest(f"'{name}' must be an ISO date (YYYY-MM-DD), got {value!r}")
+
+
+def _id_param(query, name):
+    value = query.get(name, [''])[0]
+    if value in ('', 'all'):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest(f"'{name}' must be an integer id or 'all', got {value!r}")
+
+
+class MetricsIndex:
+    """Range queries over the aggregated metrics, answered from dense restaurants × days prefix tables"""
+
+    def __init__(self, metrics, dashboard, facts=None):
+        self.dashboard = {key: value for key, value in dashboard.items() if key not in HEAVY_SECTIONS}
+        self.facts = facts if facts is not None else DenseFacts.from_metrics(metrics)
+        rest_dim = metrics.get('restaurant_dimension') or {'restaurant_id': [], 'name': [], 'country': []}
+
+        # Restaurant metadata by fact row
+        meta = {int(rid): (name if isinstance(name, str) else '', country)
+                for rid, name, country in zip(rest_dim['restaurant_id'], rest_dim['name'], rest_dim['country'])}
+        self.names = [meta.get(int(rid), ('', ''))[0] for rid in self.facts.restaurant_ids]
+        self.countries = [meta.get(int(rid), ('', ''))[1] for rid in self.facts.restaurant_ids]
+
+    def _rows(self, client_id, restaurant_id):
+        """Fact rows matching both filters, in restaurant_id order"""
+        rows = self.facts.rows(client_id, restaurant_id)
+        return rows[np.argsort(self.facts.restaurant_ids[rows], kind='stable')]
+
+    def _recon_filters(self, client_id, restaurant_id):
+        # a selected restaurant defines the reconciliation scope on its own
+        return (None if restaurant_id is not None else client_id), restaurant_id
+
+    def kpis(self, client_id=None, restaurant_id=None, lo_day=None, hi_day=None):
+        facts = self.facts
+        totals = {name: facts.total(name, client_id, restaurant_id, lo_day, hi_day) for name in SUM_COLUMNS}
+        revenue = totals['revenue'] / 100
+        expenses = totals['expenses'] / 100
+        net_profit = revenue - expenses
+
+        recon_client, recon_restaurant = self._recon_filters(client_id, restaurant_id)
+        matched = facts.total('recon_matched', recon_client, recon_restaurant, lo_day, hi_day)
+        total = facts.total('recon_total', recon_client, recon_restaurant, lo_day, hi_day)
+
+        # revenue per client: one block lookup per client in scope
+        if restaurant_id is None and client_id is None:
+            by_client = facts.client_sums('revenue', lo_day, hi_day)
+        elif restaurant_id is None:
+            by_client = {client_id: totals['revenue']} if client_id in facts.client_blocks else {}
+        else:
+            rows = facts.rows(client_id, restaurant_id)
+            by_client = {facts.client_ids[row]: totals['revenue'] for row in rows}
+        revenue_by_client = {('null' if client is None else str(client)): round(pence / 100, 2)
+                             for client, pence in by_client.items()}
+
+        return {
+            'total_revenue': round(revenue, 2),
+            'total_expenses': round(expenses, 2),
+            'net_profit': round(net_profit, 2),
+            'total_orders': totals['orders'],
+            'profit_margin': round(net_profit / revenue * 100, 2) if revenue > 0 else 0,
+            'reconciliation_rate': round(matched / total * 100, 2) if total else None,
+            'reconciliation_matched': matched,
+            'reconciliation_total': total,
+            'breakdown': {name: round(totals[name] / 100, 2) for name in SUM_COLUMNS
+                          if name not in ('orders', 'revenue', 'expenses')},
+            'revenue_by_client': revenue_by_client
+        }
+
+    def summary(self, client_id=None, restaurant_id=None, lo_day=None, hi_day=None):
+        rows = self._rows(client_id, restaurant_id)
+        sums = {name: self.facts.row_sums(name, rows, lo_day, hi_day)
+                for name in ('days', 'orders', 'revenue', 'expenses')}
+        result = []
+        for i, row in enumerate(rows):
+            if not sums['days'][i]:
+                continue
+            orders = int(sums['orders'][i])
+            revenue, expenses = sums['revenue'][i] / 100, sums['expenses'][i] / 100
+            result.append({
+                'restaurant_id': int(self.facts.restaurant_ids[row]),
+                'name': self.names[row],
+                'country': self.countries[row],
+                'client_id': self.facts.client_ids[row],
+                'total_orders': orders,
+                'total_revenue': round(revenue, 2),
+                'total_expenses': round(expenses, 2),
+                'profit': round(revenue - expenses, 2),
+                'avg_order_value': round(revenue / orders, 2) if orders else 0
+            })
+        return {'restaurants': result}
+
+    def reconciliation(self, client_id=None, restaurant_id=None, lo_day=None, hi_day=None):
+        rows = self._rows(*self._recon_filters(client_id, restaurant_id))
+        matched = self.facts.row_sums('recon_matched', rows, lo_day, hi_day)
+        total = self.facts.row_sums('recon_total', rows, lo_day, hi_day)
+        restaurants = [
+            {'restaurant_id': int(self.facts.restaurant_ids[row]), 'matched': int(m), 'total': int(t),
+             'rate': round(m / t * 100, 2)}
+            for row, m, t in zip(rows, matched, total) if t
+        ]
+        all_matched, all_total = int(matched.sum()), int(total.sum())
+        return {
+            'matched': all_matched,
+            'total': all_total,
+            'rate': round(all_matched / all_total * 100, 2) if all_total else None,
+            'restaurants': restaurants
+        }
+
+
+class QueryServer:
+    """Minimal asyncio HTTP/1.1 server for the GET endpoints below"""
+
+    def __init__(self, index):
+        self.index = index
+        self.routes = {
+            '/dashboard': lambda q: self.index.dashboard,
+            '/kpis': lambda q: self.index.kpis(**self._filters(q)),
+            '/summary': lambda q: self.index.summary(**self._filters(q)),
+            '/reconciliation': lambda q: self.index.reconciliation(**self._filters(q)),
+        }
+
+    @staticmethod
+    def _filters(query):
+        return {
+            'client_id': _id_param(query, 'client_id'),
+            'restaurant_id': _id_param(query, 'restaurant_id'),
+            'lo_day': _day_param(query, 'from'),
+            'hi_day': _day_param(query, 'to'),
+        }
+
+    def dispatch(self, method, target):
+        if method not in ('GET', 'HEAD'):
+            return 405, {'error': f'{method} not allowed'}
+        url = urlsplit(target)
+        route = self.routes.get(url.path.rstrip('/') or '/')
+        if route is None:
+            return 404, {'error': f'unknown endpoint {url.path}', 'endpoints': sorted(self.routes)}
+        try:
+            return 200, route(parse_qs(url.query))
+        except BadRequest as e:
+            return 400, {'error': str(e)}
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+            try:
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                status, payload = self.dispatch(method, target)
+            except ValueError:
+                method, status, payload = 'GET', 400, {'error': 'malformed request line'}
+            body = json.dumps(payload, default=_json_default, separators=(',', ':')).encode('utf-8')
+            reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}[status]
+            head = (
+                f"HTTP/1.1 {status} {reason}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Access-Control-Allow-Origin: *\r\n"
+                "Cache-Control: no-store\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode('latin-1')
+            writer.write(head if method == 'HEAD' else head + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def _serve_forever(index, host, port):
+    server = await asyncio.start_server(QueryServer(index).handle, host, port)
+    print(f"🌐 ROS query API on http://{host}:{port} (endpoints: /dashboard /kpis /summary /reconciliation)")
+    print(f"   Open ros_dashboard_dynamic.html?api=http://{host}:{port} to use it from the dashboard")
+    async with server:
+        await server.serve_forever()
+
+
+def serve(metrics, dashboard, host=DEFAULT_HOST, port=DEFAULT_PORT, facts=None):
+    """Index the aggregated metrics and serve them until interrupted"""
+    index = MetricsIndex(metrics, dashboard, facts)
+    try:
+        asyncio.run(_serve_forever(index, host, port))
+    except KeyboardInterrupt:
+        print("\n👋 Query API stopped")
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+ROS Benchmark Harness
+Runs load_and_analyze_data() and generate_dashboard_data() against seeded synthetic
+datasets at several scales and records wall time, peak RSS and output size per scale.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import subprocess
+from datetime import datetime
+
+from ros_synthetic_data import generate_dataset, read_manifest
+
+# name -> (restaurants, days, orders per restaurant-day)
+SCALES = {
+    'small': (50, 365, 30),
+    'medium': (500, 730, 100),
+    'large': (5000, 1095, 200)
+}
+SYNTHETIC_DIR = 'synthetic_data'
+RESULTS_PATH = 'benchmark_results.json'
+
+
+def _scale_dir(restaurants, days, orders_per_day):
+    return os.path.join(SYNTHETIC_DIR, f'{restaurants}x{days}x{orders_per_day}')
+
+
+def _parse_scale(text):
+    """'small' or '200x365x50' -> (name, (restaurants, days, orders_per_day))"""
+    if text in SCALES:
+        return text, SCALES[text]
+    try:
+        restaurants, days, orders_per_day = (int(part) for part in text.lower().split('x'))
+    except ValueError:
+        raise SystemExit(f"❌ Unknown scale '{text}': use {', '.join(SCALES)} or RxDxN, e.g. 200x365x50")
+    return text, (restaurants, days, orders_per_day)
+
+
+def ensure_dataset(restaurants, days, orders_per_day, seed=42):
+    """Generate the dataset for this scale unless a matching one is already on disk"""
+    out_dir = _scale_dir(restaurants, days, orders_per_day)
+    manifest = read_manifest(out_dir)
+    if not manifest or manifest.get('seed') != seed:
+        print(f"🧪 Generating {restaurants} restaurants × {days} days × {orders_per_day} orders/day...")
+        generate_dataset(out_dir, restaurants, days, orders_per_day, seed=seed)
+    return out_dir
+
+
+def _peak_rss_bytes():
+    """Peak resident set size of this process (ru_maxrss is KiB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_pipeline(data_dir, output_path, options):
+    """Time the pipeline stages in this process against data_dir (called in a fresh child)"""
+    import ros_data_processor as ros
+
+    ros.DATA_DIR = data_dir
+    ros.CACHE_DIR = os.path.join(data_dir, '.ros_cache')
+    ros.USE_CSV_CACHE = options.get('cache', False)
+    ros.STREAM_ORDERS = options.get('stream', False)
+    ros.WORKERS = options.get('workers', 1)
+    ros.DASHBOARD_FORMAT = options.get('format', ros.DASHBOARD_FORMAT)
+
+    timings = {}
+    start = time.perf_counter()
+    metrics = ros.load_and_analyze_data()
+    timings['load_and_analyze'] = time.perf_counter() - start
+    if not metrics:
+        raise RuntimeError(f"load_and_analyze_data() failed for {data_dir}")
+
+    start = time.perf_counter()
+    dashboard = ros.generate_dashboard_data(metrics=metrics)
+    timings['generate_dashboard'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ros.save_dashboard_data(dashboard, output_path, compress=())
+    timings['save_dashboard'] = time.perf_counter() - start
+
+    input_bytes = sum(os.path.getsize(os.path.join(data_dir, name))
+                      for name in ros.CSV_FILES.values())
+    return {
+        'wall_seconds': {stage: round(seconds, 4) for stage, seconds in timings.items()},
+        'total_seconds': round(sum(timings.values()), 4),
+        'peak_rss_bytes': _peak_rss_bytes(),
+        'input_bytes': input_bytes,
+        'output_bytes': os.path.getsize(output_path),
+        'daily_records': len(metrics['per_restaurant_daily']),
+        'summary_records': len(metrics['restaurants_summary'])
+    }
+
+
+def benchmark_scale(name, scale, options, repeat=1, verbose=False):
+    """Run one scale `repeat` times in child processes and keep the fastest run"""
+    data_dir = ensure_dataset(*scale, seed=options.get('seed', 42))
+    output_path = os.path.join(data_dir, 'benchmark_dashboard.json')
+    result_path = os.path.join(data_dir, 'benchmark_run.json')
+    runs = []
+    for i in range(repeat):
+        print(f"⏱️ {name} ({'×'.join(map(str, scale))}) run {i + 1}/{repeat}...")
+        # a fresh interpreter per run so peak RSS belongs to this scale alone
+        command = [sys.executable, os.path.abspath(__file__), '_run', data_dir, output_path,
+                   result_path, json.dumps(options)]
+        subprocess.run(command, check=True, stdout=None if verbose else subprocess.DEVNULL)
+        with open(result_path) as f:
+            runs.append(json.load(f))
+        os.remove(result_path)
+
+    best = min(runs, key=lambda run: run['total_seconds'])
+    best['runs_total_seconds'] = [run['total_seconds'] for run in runs]
+    best['peak_rss_bytes'] = max(run['peak_rss_bytes'] for run in runs)
+    manifest = read_manifest(data_dir)
+    return {'scale': name, 'restaurants': scale[0], 'days': scale[1], 'orders_per_day': scale[2],
+            'rows': manifest['rows'], **best}
+
+
+def compare_to_baseline(results, baseline_path, tolerance):
+    """Names of scales whose total time or peak RSS grew beyond tolerance vs a previous results file"""
+    with open(baseline_path) as f:
+        baseline = {entry['scale']: entry for entry in json.load(f)['results']}
+    regressions = []
+    for entry in results:
+        before = baseline.get(entry['scale'])
+        if not before:
+            continue
+        for key in ('total_seconds', 'peak_rss_bytes'):
+            if before[key] and entry[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{entry['scale']}: {key} {before[key]} -> {entry[key]}")
+    return regressions
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '_run':
+        data_dir, output_path, result_path, options = sys.argv[2:6]
+        result = run_pipeline(data_dir, output_path, json.loads(options))
+        with open(result_path, 'w') as f:
+            json.dump(result, f)
+        raise SystemExit(0)
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the ROS pipeline on synthetic data")
+    parser.add_argument('scales', nargs='*', default=['small'],
+                        help=f"scales to run: {', '.join(SCALES)} or RxDxN (default: small)")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per scale; the fastest is recorded")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--cache', action='store_true', help="allow columnar CSV snapshots (off by default)")
+    parser.add_argument('--format', choices=['columnar', 'records'], default='columnar')
+    parser.add_argument('--output', default=RESULTS_PATH, help="results JSON (default: %(default)s)")
+    parser.add_argument('--baseline', help="previous results JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed slowdown / memory growth vs --baseline (default: %(default)s)")
+    parser.add_argument('--verbose', action='store_true', help="show the pipeline's own output")
+    args = parser.parse_args()
+
+    options = {'seed': args.seed, 'workers': args.workers, 'stream': args.stream,
+               'cache': args.cache, 'format': args.format}
+    results = []
+    for name, scale in map(_parse_scale, args.scales):
+        entry = benchmark_scale(name, scale, options, repeat=args.repeat, verbose=args.verbose)
+        results.append(entry)
+        print(f"   • {name}: {entry['total_seconds']:.2f}s, peak RSS {entry['peak_rss_bytes'] / 2**20:.0f} MiB, "
+              f"output {entry['output_bytes'] / 2**20:.1f} MiB")
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'generated_at': datetime.now().isoformat(),
+            'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                            'cpu_count': os.cpu_count()},
+            'options': options,
+            'results': results
+        }, f, indent=2)
+    print(f"✅ Results written to {args.output}")
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f"⚠️ Regression: {line}")
+        if regressions:
+            raise SystemExit(1)
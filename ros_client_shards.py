@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+ROS Client Shards - one pre-filtered dashboard payload per client_id plus an index
+Each client's file holds only its restaurants' daily facts, summary, reconciliation,
+banking variance, users and subscription utilization, with KPIs recomputed over that
+slice, so a tenant's page never downloads (or sees) another client's data.
+"""
+
+import os
+import json
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import ros_data_processor as ros
+from ros_sketches import merge_encoded
+
+CLIENT_INDEX_FILE = 'index.json'
+
+# the aggregated metrics every worker builds its shards from (set once per worker)
+_SHARED_METRICS = None
+
+
+def _take(columns, mask):
+    """Rows of a column dict where mask is True"""
+    return {key: (np.asarray(col) if isinstance(col, list) else col)[mask] for key, col in columns.items()}
+
+
+def _total(columns, key):
+    return round(float(np.sum(columns[key])), 2) if key in columns else 0.0
+
+
+def client_metrics(metrics, client_id):
+    """The metrics generate_dashboard_data() reads, restricted to one client and recomputed over it"""
+    dim = metrics['restaurant_dimension']
+    in_client = np.array([cid == client_id for cid in dim['client_id']], dtype=bool)
+    restaurant_ids = np.asarray(dim['restaurant_id'])[in_client]
+    ids = set(restaurant_ids.tolist())
+
+    def of_restaurants(columns):
+        return _take(columns, np.isin(np.asarray(columns['restaurant_id']), restaurant_ids))
+
+    scoped = {'restaurant_dimension': _take(dim, in_client)}
+
+    daily = of_restaurants(metrics.get('per_restaurant_daily_columns') or {'restaurant_id': [], 'day': []})
+    scoped['per_restaurant_daily_columns'] = daily
+    scoped['per_restaurant_daily'] = ros.ColumnRecords(ros._with_iso_dates(daily))
+    recon = of_restaurants(metrics.get('reconciliation_daily_columns') or {'restaurant_id': [], 'day': [], 'is_match': []})
+    scoped['reconciliation_daily_columns'] = recon
+    scoped['reconciliation_daily'] = ros.ColumnRecords(ros._with_iso_dates(recon))
+    if metrics.get('banking_variance_daily_columns'):
+        variance = of_restaurants(metrics['banking_variance_daily_columns'])
+        scoped['banking_variance_daily_columns'] = variance
+        scoped['banking_variance_daily'] = ros.ColumnRecords(ros._with_iso_dates(variance))
+        if len(variance['variance']):
+            scoped['avg_banking_variance'] = round(float(np.abs(variance['variance']).mean()), 2)
+            scoped['max_banking_variance'] = round(float(np.abs(variance['variance']).max()), 2)
+    scoped['banking_anomalies'] = [row for row in metrics.get('banking_anomalies', []) if row['restaurant_id'] in ids]
+
+    # lists and per-restaurant records
+    scoped['restaurants_summary'] = [row for row in metrics.get('restaurants_summary', []) if row['restaurant_id'] in ids]
+    scoped['restaurants_list'] = [row for row in metrics.get('restaurants_list', []) if row['restaurant_id'] in ids]
+    scoped['clients_list'] = [row for row in metrics.get('clients_list', []) if row['client_id'] == client_id]
+    scoped['users_list'] = [row for row in metrics.get('users_list', []) if row['client_id'] == client_id]
+    utilization = [row for row in metrics.get('client_subscription_utilization', []) if row['client_id'] == client_id]
+    scoped['client_subscription_utilization'] = utilization
+    # the plan catalogue row for this client's subscription, counting only its own users
+    costs = {row['name']: row['cost'] for row in metrics.get('subscription_analysis', [])}
+    scoped['subscription_analysis'] = [{
+        'name': row['subscription_name'], 'cost': costs.get(row['subscription_name'], 0),
+        'max_users': row['max_users'], 'current_users': row['current_users'], 'utilization': row['utilization']
+    } for row in utilization if row['subscription_id'] is not None]
+
+    # overview counts
+    countries = np.asarray(scoped['restaurant_dimension']['country'])
+    scoped['total_clients'] = len(scoped['clients_list'])
+    scoped['total_restaurants'] = len(restaurant_ids)
+    scoped['uk_restaurants'] = int((countries == 'UK').sum())
+    scoped['india_restaurants'] = int((countries == 'India').sum())
+    scoped['active_clients'] = sum(1 for row in scoped['clients_list'] if row['is_active'])
+    scoped['inactive_clients'] = scoped['total_clients'] - scoped['active_clients']
+    scoped['total_users'] = len(scoped['users_list'])
+
+    # financial KPIs over the client's restaurant-days, as the dashboard's client filter computes them
+    scoped['total_orders'] = int(np.sum(daily['orders'])) if 'orders' in daily else 0
+    scoped['total_revenue'] = _total(daily, 'revenue')
+    scoped['total_expenses'] = _total(daily, 'expenses')
+    scoped['revenue_breakdown'] = {
+        'food_revenue': _total(daily, 'food_payment'),
+        'drinks_revenue': _total(daily, 'drinks_payment'),
+        'other_revenue': _total(daily, 'other_payment'),
+        'service_charges': _total(daily, 'service_charges'),
+        'delivery_charges': _total(daily, 'delivery_charges')
+    }
+    scoped['expense_breakdown'] = {col: _total(daily, col) for col in ros.EXPENSE_CATEGORY_COLUMNS}
+    net_profit = scoped['total_revenue'] - scoped['total_expenses']
+    scoped['net_profit'] = round(net_profit, 2)
+    if scoped['total_revenue']:
+        scoped['profit_margin'] = round(net_profit / scoped['total_revenue'] * 100, 2)
+    if len(recon['is_match']):
+        scoped['reconciliation_rate'] = round(float(np.mean(recon['is_match'])) * 100, 2)
+
+    # order value and top restaurants from the per-restaurant order totals
+    scoped['restaurant_performance'] = []
+    if metrics.get('restaurant_order_totals'):
+        totals = of_restaurants(metrics['restaurant_order_totals'])
+        if totals['orders'].sum():
+            scoped['avg_order_value'] = round(float(totals['order_total'].sum() / totals['orders'].sum()), 2)
+        top = np.argsort(-totals['order_total'], kind='stable')[:10]
+        names = dict(zip(scoped['restaurant_dimension']['restaurant_id'].tolist(), scoped['restaurant_dimension']['name']))
+        country = dict(zip(scoped['restaurant_dimension']['restaurant_id'].tolist(), countries.tolist()))
+        scoped['restaurant_performance'] = ros._records({
+            'name': [names.get(rid) for rid in totals['restaurant_id'][top].tolist()],
+            'country': [country.get(rid) for rid in totals['restaurant_id'][top].tolist()],
+            'daily_orders': np.round(totals['orders'][top] / 365.0, 1),
+            'revenue': totals['order_total'][top]
+        })
+
+    # order value percentiles: only this client's restaurant sketches, merged for its overall figures
+    distribution = metrics.get('order_value_distribution')
+    if distribution:
+        sketches = distribution['restaurant_sketches']
+        positions = [i for i, rid in enumerate(sketches['key']) if rid in ids]
+        scoped['order_value_distribution'] = {
+            **{key: distribution[key] for key in ('quantiles', 'relative_accuracy', 'hll_precision')},
+            'overall': merge_encoded(sketches, positions),
+            'by_restaurant': [row for row in distribution['by_restaurant'] if row['restaurant_id'] in ids],
+            # order type and month sketches span every client, so they are not shared
+            'by_order_type': [],
+            'by_month': [],
+            'restaurant_sketches': {
+                **{key: sketches[key] for key in ('gamma', 'hll_precision')},
+                **{key: [sketches[key][i] for i in positions] for key in ('key', 'bucket_start', 'bucket_counts', 'registers')}
+            }
+        }
+    return scoped
+
+
+def _init_shard_worker(config, metrics):
+    ros._init_pool_worker(config)
+    global _SHARED_METRICS
+    _SHARED_METRICS = metrics
+
+
+def _write_shards(client_ids, out_dir, output_format, compress):
+    """Build and save the payloads for some clients; returns their index entries"""
+    entries = []
+    clients = {row['client_id']: row for row in _SHARED_METRICS.get('clients_list', [])}
+    for client_id in client_ids:
+        payload = ros.generate_dashboard_data(output_format, metrics=client_metrics(_SHARED_METRICS, client_id))
+        name = f'client_{client_id}.json'
+        ros.save_dashboard_data(payload, os.path.join(out_dir, name), compress=compress)
+        entries.append({
+            'client_id': client_id,
+            'client_name': clients.get(client_id, {}).get('client_name', ''),
+            'file': name,
+            'restaurants': len(payload['restaurants_list']),
+            'bytes': os.path.getsize(os.path.join(out_dir, name))
+        })
+    return entries
+
+
+def write_client_shards(metrics, out_dir, workers, output_format, compress, config):
+    """Write one dashboard file per client and index.json, building the shards in `workers` processes.
+
+    The settings come from the caller: when the processor runs as a script its CLI
+    settings live in `__main__`, not in the ros_data_processor module imported here.
+    `config` is the caller's _pool_config(). Workers get it and the aggregated metrics
+    once through the pool initializer (inherited copy-on-write where processes fork)
+    and are handed only client ids.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    client_ids = [row['client_id'] for row in metrics.get('clients_list', [])]
+
+    if workers <= 1 or len(client_ids) < 2:
+        _init_shard_worker(config, metrics)
+        entries = _write_shards(client_ids, out_dir, output_format, compress)
+    else:
+        # interleaved batches so big and small clients spread across the workers
+        batches = [client_ids[i::workers] for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_shard_worker,
+                                 initargs=(config, metrics)) as pool:
+            results = list(pool.map(_write_shards, batches, [out_dir] * workers,
+                                    [output_format] * workers, [compress] * workers))
+        by_client = {entry['client_id']: entry for batch in results for entry in batch}
+        entries = [by_client[client_id] for client_id in client_ids]
+
+    index = {
+        'generated_at': datetime.now().isoformat(),
+        'format': output_format,
+        'clients': entries
+    }
+    # clients that no longer exist must not keep a readable payload
+    current = {entry['file'] for entry in entries}
+    for name in os.listdir(out_dir):
+        if name.startswith('client_') and name.split('.json')[0] + '.json' not in current:
+            os.remove(os.path.join(out_dir, name))
+
+    index_path = os.path.join(out_dir, CLIENT_INDEX_FILE)
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(index_path + '.tmp', index_path)
+    return index
@@ -7,9 +7,733 @@ Includes all fixes for date parsing, subscription data, and data merging
 
 import pandas as pd
 import json
+import os
+import io
+import sys
+import csv
+import hashlib
+import gzip
+import time
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import redirect_stdout
 from datetime import datetime
 import numpy as np
 
+from ros_profiler import StageProfiler
+from ros_dense_facts import DenseFacts
+from ros_fact_snapshot import write_fact_snapshot
+from ros_validation import coerce_columns, reject_unparsed_dates, validate_tables, save_quarantine_report, TABLE_KEYS, FOREIGN_KEYS
+from ros_sketches import OrderSketches, SKETCH_FRAMES
+
+# Parquet snapshots when pyarrow is installed (pandas imports it itself)
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Data file locations
+DATA_DIR = 'csv_data'
+CSV_FILES = {
+    'clients': 'clients.csv',
+    'restaurants': 'restaurants.csv',
+    'users': 'users.csv',
+    'subscriptions': 'subscriptions.csv',
+    'orders': 'orders.csv',
+    'sales': 'sales.csv',
+    'expenses': 'expenses.csv',
+    'cashup': 'cashup.csv',
+    'banking': 'banking.csv'
+}
+
+# Per-table read schema: the columns actually used, compact dtypes, dates parsed
+# at read time with their known formats, and order money held as integer pence
+# (nullable Int32) so the large orders table stays small and its sums exact.
+# The one-row-per-restaurant-day tables keep float64 money for exact £ totals.
+TABLE_SCHEMAS = {
+    'clients': {
+        'dtype': {'client_id': 'int32', 'legal_name': str, 'is_active': 'bool',
+                  'country_id': 'int16', 'subscription_id': 'Int32'}
+    },
+    'restaurants': {
+        'dtype': {'id': 'int32', 'name': str, 'client_id': 'Int32', 'country_id': 'int16'}
+    },
+    'users': {
+        'dtype': {'user_id': 'int32', 'client_id': 'Int32', 'restaurant_id': 'Int32'}
+    },
+    'subscriptions': {
+        'dtype': {'subscription_id': 'int32', 'subscription_name': str, 'cost': 'float64',
+                  'no_of_users': 'int32'}
+    },
+    'orders': {
+        'dtype': {'order_id': 'int32', 'restaurant_id': 'int32', 'order_type': 'category',
+                  'order_total': 'float64', 'food_amount': 'float64', 'drinks_amount': 'float64'},
+        'dates': {'order_date': '%d-%m-%Y'},
+        'pence': ['order_total', 'food_amount', 'drinks_amount']
+    },
+    'sales': {
+        'dtype': {'restaurant_id': 'int32', 'food_payment': 'float64', 'drinks_payment': 'float64',
+                  'other_payment': 'float64', 'service_charges': 'float64', 'delivery_charges': 'float64'},
+        'dates': {'date': '%Y-%m-%d'}
+    },
+    'expenses': {
+        'dtype': {'restaurant_id': 'int32', 'bills': 'float64', 'vendors': 'float64',
+                  'wage_advance': 'float64', 'repairs': 'float64', 'sundries': 'float64', 'amount': 'float64'},
+        'dates': {'exp_date': '%Y-%m-%d'}
+    },
+    'cashup': {
+        'dtype': {'restaurant_id': 'int32', 'eod_amount': 'float64', 'is_match': 'bool',
+                  'banking_id': 'Int32', 'cashup_status': 'category'},
+        'dates': {'cash_up_date': '%Y-%m-%d'}
+    },
+    'banking': {
+        'dtype': {'banking_id': 'int32', 'banking_total': 'float64', 'banked_total': 'float64',
+                  'reconcile_status': 'category',
+                  'banking_time_indicator': 'category'}
+    }
+}
+
+
+def read_table_csv(table, schema=None, rejects=None):
+    """Parse one csv_data table with its schema: pruned columns, typed ids, dates and pence.
+
+    If a value doesn't fit its dtype the file is re-read as text and coerced column-wise.
+    Those rows, and rows whose date text doesn't parse, are left out and, when a `rejects`
+    dict is given, stored in rejects[table] with their CSV `line` for the quarantine report.
+    """
+    schema = TABLE_SCHEMAS[table] if schema is None else schema
+    dtype = schema.get('dtype', {})
+    dates = schema.get('dates', {})
+    path = os.path.join(DATA_DIR, CSV_FILES[table])
+    rejected = []
+    try:
+        df = pd.read_csv(path, usecols=list(dtype) + list(dates), dtype=dtype)
+    except (ValueError, TypeError, OverflowError) as e:
+        print(f"⚠️ {CSV_FILES[table]} has values that don't fit the schema ({e}); quarantining those rows")
+        raw = pd.read_csv(path, usecols=list(dtype) + list(dates), dtype=str)
+        df, bad_values = coerce_columns(raw, dtype)
+        if len(bad_values):
+            rejected.append(bad_values)
+
+    # keep the date text so an unparseable date is reported as written (rows are indexed by file position)
+    text = df[list(dates)].copy()
+    df = _apply_schema_conversions(df, schema)
+    if table != 'orders':
+        bad_dates = reject_unparsed_dates(df, text)
+        if len(bad_dates):
+            df = df.drop(bad_dates.index)
+            rejected.append(bad_dates)
+    if rejected and rejects is not None:
+        rejects[table] = pd.concat(rejected).sort_values('line') if len(rejected) > 1 else rejected[0]
+    return df.reset_index(drop=True) if rejected else df
+
+
+def iter_table_chunks(table, chunksize, schema=None):
+    """Yield a csv_data table in fixed-size chunks, each typed like read_table_csv()"""
+    schema = TABLE_SCHEMAS[table] if schema is None else schema
+    dtype = schema.get('dtype', {})
+    dates = schema.get('dates', {})
+    reader = pd.read_csv(
+        os.path.join(DATA_DIR, CSV_FILES[table]),
+        usecols=list(dtype) + list(dates),
+        dtype=dtype,
+        chunksize=chunksize
+    )
+    with reader:
+        for chunk in reader:
+            yield _apply_schema_conversions(chunk, schema)
+
+
+# Dates are held as int32 day keys (days since 1970-01-01) and only formatted at output
+def _day_keys(values):
+    """int32 day keys from datetimes; nullable Int32 when some are missing (NaT)"""
+    days = np.asarray(values, dtype='datetime64[D]')
+    missing = np.isnat(days)
+    keys = np.where(missing, 0, days.astype('int64')).astype('int32')
+    if missing.any():
+        return pd.arrays.IntegerArray(keys, missing)
+    return keys
+
+
+def _iso_dates(days):
+    """ISO 'YYYY-MM-DD' strings for day keys (None where missing), each distinct day formatted once"""
+    codes, uniques = pd.factorize(pd.Series(days, copy=False))
+    strings = np.datetime_as_string(np.asarray(uniques, dtype='int64').astype('datetime64[D]')).astype(object)
+    return np.append(strings, None)[codes]
+
+
+def _apply_schema_conversions(df, schema):
+    for col, fmt in schema.get('dates', {}).items():
+        df[col] = _day_keys(pd.to_datetime(df[col], format=fmt, errors='coerce'))
+    for col in schema.get('pence', []):
+        df[col] = pd.array(np.rint(df[col].to_numpy() * 100), dtype='Int32')
+    return df
+
+
+# Columnar snapshot cache for the CSV inputs
+CACHE_DIR = os.path.join(DATA_DIR, '.ros_cache')
+CACHE_VERSION = 2
+USE_CSV_CACHE = True
+
+
+def _file_digest(path, block_size=1 << 20):
+    """Content hash of a source file, read in 1MB blocks"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_options_key(schema):
+    """Stable fingerprint of the read schema a snapshot was built with"""
+    return hashlib.blake2b(repr(sorted(schema.items())).encode(), digest_size=8).hexdigest()
+
+
+def _load_cache_entry(table):
+    """Read the metadata describing a table's snapshot, if it is from this cache version"""
+    try:
+        with open(os.path.join(CACHE_DIR, f'{table}.meta.json')) as f:
+            entry = json.load(f)
+        if entry.get('version') == CACHE_VERSION:
+            return entry
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _save_cache_entry(table, entry):
+    meta_path = os.path.join(CACHE_DIR, f'{table}.meta.json')
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(entry, f, indent=2)
+    os.replace(tmp_path, meta_path)
+
+
+def _write_npz_snapshot(df, path):
+    """Store a DataFrame as typed column arrays in an uncompressed .npz (no pickling)"""
+    arrays = {'__columns__': np.array([str(c) for c in df.columns])}
+    for i, col in enumerate(df.columns):
+        s = df[col]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            arrays[f'{i}__codes'] = s.cat.codes.to_numpy()
+            arrays[f'{i}__categories'] = np.array([str(c) for c in s.cat.categories])
+        elif isinstance(s.dtype, pd.api.extensions.ExtensionDtype) and pd.api.types.is_numeric_dtype(s.dtype):
+            # Nullable integers: raw values plus a null mask
+            arrays[f'{i}__masked'] = s.fillna(0).to_numpy(dtype=s.dtype.numpy_dtype)
+            arrays[f'{i}__mask'] = s.isna().to_numpy()
+            arrays[f'{i}__dtype'] = np.array(str(s.dtype))
+        elif pd.api.types.is_bool_dtype(s.dtype) or pd.api.types.is_numeric_dtype(s.dtype) \
+                or pd.api.types.is_datetime64_dtype(s.dtype):
+            arrays[f'{i}__values'] = s.to_numpy()
+        else:
+            # Dictionary-encode strings so repeated values (dates, types) are stored once
+            codes, uniques = pd.factorize(s)
+            arrays[f'{i}__strcodes'] = codes.astype(np.int32)
+            arrays[f'{i}__strings'] = np.array([str(u) for u in uniques], dtype=str)
+    np.savez(path, **arrays)
+
+
+def _read_npz_snapshot(path):
+    with np.load(path, allow_pickle=False) as npz:
+        columns = npz['__columns__'].tolist()
+        data = {}
+        for i, col in enumerate(columns):
+            if f'{i}__codes' in npz:
+                data[col] = pd.Categorical.from_codes(npz[f'{i}__codes'], categories=npz[f'{i}__categories'])
+            elif f'{i}__masked' in npz:
+                values = pd.array(npz[f'{i}__masked'], dtype=str(npz[f'{i}__dtype']))
+                values[npz[f'{i}__mask']] = pd.NA
+                data[col] = values
+            elif f'{i}__values' in npz:
+                data[col] = npz[f'{i}__values']
+            else:
+                codes = npz[f'{i}__strcodes']
+                uniques = npz[f'{i}__strings'].astype(object)
+                values = uniques.take(codes, mode='clip') if len(uniques) else np.full(len(codes), None, dtype=object)
+                values[codes < 0] = np.nan
+                data[col] = values
+    return pd.DataFrame(data, columns=columns)
+
+
+def _write_snapshot(df, table):
+    """Write a table snapshot atomically; Parquet when pyarrow is available, .npz otherwise"""
+    fmt = 'parquet' if HAS_PYARROW else 'npz'
+    snapshot = os.path.join(CACHE_DIR, f'{table}.{fmt}')
+    tmp_path = os.path.join(CACHE_DIR, f'{table}.tmp.{fmt}')
+    if fmt == 'parquet':
+        df.to_parquet(tmp_path, index=False)
+    else:
+        _write_npz_snapshot(df, tmp_path)
+    os.replace(tmp_path, snapshot)
+    return snapshot, fmt
+
+
+def _read_snapshot(snapshot, fmt):
+    if fmt == 'parquet':
+        return pd.read_parquet(snapshot)
+    return _read_npz_snapshot(snapshot)
+
+
+def load_table(table, use_cache=None, schema=None, rejects=None):
+    """Load one csv_data table, reusing its columnar snapshot while the source is unchanged.
+
+    A snapshot is reused when the CSV's size and mtime match its cache metadata. If only
+    the mtime moved (file touched or re-copied), the content hash decides. Rows rejected
+    while parsing go to `rejects` (see read_table_csv).
+    """
+    if use_cache is None:
+        use_cache = USE_CSV_CACHE
+    schema = TABLE_SCHEMAS[table] if schema is None else schema
+    source = os.path.join(DATA_DIR, CSV_FILES[table])
+    if not use_cache:
+        return read_table_csv(table, schema, rejects)
+
+    stat = os.stat(source)
+    options_key = _read_options_key(schema)
+    entry = _load_cache_entry(table)
+    snapshot = os.path.join(CACHE_DIR, entry['snapshot']) if entry else None
+
+    if entry and entry['options'] == options_key and entry['size'] == stat.st_size \
+            and os.path.exists(snapshot):
+        try:
+            if entry['mtime_ns'] == stat.st_mtime_ns:
+                return _read_snapshot(snapshot, entry['format'])
+            if _file_digest(source) == entry['hash']:
+                entry['mtime_ns'] = stat.st_mtime_ns
+                _save_cache_entry(table, entry)
+                return _read_snapshot(snapshot, entry['format'])
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable cache snapshot for {table}: {e}")
+
+    found = {}
+    df = read_table_csv(table, schema, found)
+    if found:
+        if rejects is not None:
+            rejects.update(found)
+        # re-parse until the CSV is fixed, so the rejected rows stay in the report
+        return df
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        snapshot, fmt = _write_snapshot(df, table)
+        _save_cache_entry(table, {
+            'version': CACHE_VERSION,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'hash': _file_digest(source),
+            'options': options_key,
+            'snapshot': os.path.basename(snapshot),
+            'format': fmt
+        })
+    except Exception as e:
+        print(f"⚠️ Could not write cache snapshot for {table}: {e}")
+    return df
+
+# Orders are only ever aggregated; --stream folds orders.csv chunk by chunk
+STREAM_ORDERS = False
+ORDERS_CHUNK_SIZE = 250000
+ORDER_AMOUNT_COLUMNS = ['order_total', 'food_amount', 'drinks_amount']
+
+
+def _combine_counts(left, right):
+    """Add two keyed count/sum Series, treating missing keys as zero"""
+    if left.empty:
+        return right.copy()
+    if right.empty:
+        return left
+    return left.add(right, fill_value=0).astype('int64')
+
+
+class OrderAggregates:
+    """Mergeable partial aggregates over orders: sums, counts and grouped counts.
+
+    Amounts are integer pence, so partials built from any chunking (or any
+    split of the file) merge to exactly the same totals.
+    """
+    FRAMES = ('amounts', 'types', 'daily', 'restaurants') + tuple(f'sketch_{name}' for name in SKETCH_FRAMES)
+
+    def __init__(self):
+        self.count = 0
+        self.amount_sums = pd.Series(0, index=ORDER_AMOUNT_COLUMNS, dtype='int64')
+        self.amount_counts = pd.Series(0, index=ORDER_AMOUNT_COLUMNS, dtype='int64')
+        self.type_counts = pd.Series(dtype='int64')         # rows per order_type
+        self.type_total_sums = pd.Series(dtype='int64')     # order_total pence per order_type
+        self.type_total_counts = pd.Series(dtype='int64')   # non-null order_total per order_type
+        self.daily_counts = pd.Series(dtype='int64')        # rows per (restaurant_id, order_date)
+        self.restaurant_counts = pd.Series(dtype='int64')   # rows per restaurant_id
+        self.restaurant_totals = pd.Series(dtype='int64')   # order_total pence per restaurant_id
+        self.sketches = OrderSketches()                     # order_total quantiles, distinct orders
+
+    @classmethod
+    def from_frame(cls, orders):
+        aggs = cls()
+        aggs.add(orders)
+        return aggs
+
+    def add(self, orders):
+        """Fold a chunk of typed order rows into the running aggregates"""
+        if orders.empty:
+            return self
+        part = OrderAggregates()
+        part.count = len(orders)
+        part.amount_sums = orders[ORDER_AMOUNT_COLUMNS].sum().astype('int64')
+        part.amount_counts = orders[ORDER_AMOUNT_COLUMNS].count().astype('int64')
+
+        by_type = orders.groupby('order_type', observed=True)['order_total']
+        part.type_counts = by_type.size().astype('int64')
+        part.type_total_sums = by_type.sum().astype('int64')
+        part.type_total_counts = by_type.count().astype('int64')
+        for series in (part.type_counts, part.type_total_sums, part.type_total_counts):
+            # chunks infer their own categories, so key by the plain label
+            series.index = series.index.astype(object)
+
+        part.daily_counts = orders.groupby(['restaurant_id', 'order_date']).size().astype('int64')
+        by_restaurant = orders.groupby('restaurant_id')
+        part.restaurant_counts = by_restaurant['order_id'].count().astype('int64')
+        part.restaurant_totals = by_restaurant['order_total'].sum().astype('int64')
+        part.sketches = OrderSketches.from_frame(orders)
+        return self.merge(part)
+
+    def merge(self, other):
+        """Combine another partial into this one (in place) and return self"""
+        self.count += other.count
+        self.amount_sums = self.amount_sums + other.amount_sums
+        self.amount_counts = self.amount_counts + other.amount_counts
+        for name in ('type_counts', 'type_total_sums', 'type_total_counts',
+                     'daily_counts', 'restaurant_counts', 'restaurant_totals'):
+            setattr(self, name, _combine_counts(getattr(self, name), getattr(other, name)))
+        self.sketches.merge(other.sketches)
+        return self
+
+    def to_frames(self):
+        """Tabular form of the aggregates, for persisting between runs"""
+        return {
+            'amounts': pd.DataFrame({'sum': self.amount_sums, 'count': self.amount_counts})
+                         .rename_axis('column').reset_index(),
+            'types': pd.DataFrame({'count': self.type_counts, 'total_sum': self.type_total_sums,
+                                   'total_count': self.type_total_counts})
+                       .rename_axis('order_type').reset_index(),
+            'daily': self.daily_counts.rename('count').rename_axis(['restaurant_id', 'order_date']).reset_index(),
+            'restaurants': pd.DataFrame({'count': self.restaurant_counts, 'total': self.restaurant_totals})
+                             .rename_axis('restaurant_id').reset_index(),
+            **{f'sketch_{name}': frame for name, frame in self.sketches.to_frames().items()}
+        }
+
+    @classmethod
+    def from_frames(cls, count, frames):
+        aggs = cls()
+        aggs.count = int(count)
+        if not count:
+            return aggs
+        amounts = frames['amounts'].set_index('column')
+        aggs.amount_sums = amounts['sum'].reindex(ORDER_AMOUNT_COLUMNS).astype('int64')
+        aggs.amount_counts = amounts['count'].reindex(ORDER_AMOUNT_COLUMNS).astype('int64')
+        types = frames['types'].set_index('order_type')
+        types.index = types.index.astype(object)
+        aggs.type_counts = types['count'].astype('int64')
+        aggs.type_total_sums = types['total_sum'].astype('int64')
+        aggs.type_total_counts = types['total_count'].astype('int64')
+        aggs.daily_counts = frames['daily'].set_index(['restaurant_id', 'order_date'])['count'].astype('int64')
+        restaurants = frames['restaurants'].set_index('restaurant_id')
+        aggs.restaurant_counts = restaurants['count'].astype('int64')
+        aggs.restaurant_totals = restaurants['total'].astype('int64')
+        aggs.sketches = OrderSketches.from_frames({name[len('sketch_'):]: frame for name, frame in frames.items()
+                                                   if name.startswith('sketch_')})
+        return aggs
+
+    def mean_amount(self, column):
+        """Mean of an amount column in pounds"""
+        n = self.amount_counts[column]
+        return self.amount_sums[column] / n / 100 if n else float('nan')
+
+    def mean_total_for_type(self, order_type):
+        n = self.type_total_counts.get(order_type, 0)
+        return self.type_total_sums[order_type] / n / 100 if n else float('nan')
+
+
+def load_order_aggregates(stream=None, chunksize=None, rejects=None):
+    """Aggregate orders.csv, either from the whole table or streamed in fixed-size chunks"""
+    if stream is None:
+        stream = STREAM_ORDERS
+    if not stream:
+        return OrderAggregates.from_frame(load_table('orders', rejects=rejects))
+    aggs = OrderAggregates()
+    for chunk in iter_table_chunks('orders', chunksize or ORDERS_CHUNK_SIZE):
+        aggs.add(chunk)
+    return aggs
+
+
+# Parallel ingestion: the tables are independent and pandas' C parser releases the
+# GIL, so they are read on a thread pool. Tables in PROCESS_POOL_TABLES (typically
+# orders, which comes back as small aggregates) are loaded in worker processes.
+LOAD_WORKERS = min(len(CSV_FILES), os.cpu_count() or 1)
+PROCESS_POOL_TABLES = ()
+
+
+def _pool_config():
+    """Module settings a worker process needs to load tables the same way"""
+    names = ('DATA_DIR', 'CACHE_DIR', 'USE_CSV_CACHE', 'STREAM_ORDERS', 'ORDERS_CHUNK_SIZE')
+    return {name: globals()[name] for name in names}
+
+
+def _init_pool_worker(config):
+    globals().update(config)
+
+
+def _load_for_analysis(table, rejects=None):
+    """orders.csv is aggregated while loading; the other tables come back as frames"""
+    return load_order_aggregates(rejects=rejects) if table == 'orders' else load_table(table, rejects=rejects)
+
+
+def _load_with_rejects(loader, table):
+    """(loader's result, rows it rejected) - returned together so a worker process's rejects reach the parent"""
+    rejects = {}
+    return loader(table, rejects=rejects), rejects
+
+
+def load_tables(tables, workers=None, process_tables=None, loader=_load_for_analysis, rejects=None):
+    """Load tables concurrently and return {table: loader(table)} in the given order.
+
+    Uses a pool of `workers` threads (sequential when workers <= 1); tables listed in
+    `process_tables` go to a process pool instead, so `loader` must be picklable then.
+    `loader` takes a `rejects` keyword; the rows it rejects are merged into `rejects`.
+    """
+    workers = LOAD_WORKERS if workers is None else workers
+    process_tables = PROCESS_POOL_TABLES if process_tables is None else process_tables
+    tables = list(tables)
+    rejects = {} if rejects is None else rejects
+
+    def collect(results):
+        for _, found in results.values():
+            rejects.update(found)
+        return {table: value for table, (value, _) in results.items()}
+
+    if workers <= 1:
+        return collect({table: _load_with_rejects(loader, table) for table in tables})
+
+    in_processes = [table for table in tables if table in process_tables]
+    processes = None
+    if in_processes:
+        processes = ProcessPoolExecutor(max_workers=min(workers, len(in_processes)),
+                                        initializer=_init_pool_worker, initargs=(_pool_config(),))
+    try:
+        with ThreadPoolExecutor(max_workers=min(workers, len(tables))) as threads:
+            futures = {
+                table: (processes if table in in_processes else threads).submit(_load_with_rejects, loader, table)
+                for table in tables
+            }
+            return collect({table: futures[table].result() for table in tables})
+    finally:
+        if processes is not None:
+            processes.shutdown()
+
+
+# Incremental processing: the CSV exports are append-only, so the typed fact rows
+# (one per restaurant-day for sales/expenses/cashup/banking) and the order
+# aggregates are persisted with a byte-offset watermark per table, and each run
+# only parses what was appended since.
+STATE_DIR = 'ros_dashboard_state'
+STATE_VERSION = 3
+INCREMENTAL = False
+FINGERPRINT_WINDOW = 4096
+
+
+class _ByteRange(io.RawIOBase):
+    """Read at most `remaining` bytes from an already positioned binary file"""
+
+    def __init__(self, f, remaining):
+        self.f = f
+        self.remaining = remaining
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self.remaining)
+        data = self.f.read(n)
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+
+def _csv_header(path):
+    with open(path, 'rb') as f:
+        return f.readline()
+
+
+def _csv_fingerprint(path, offset):
+    """Hash of the header and the bytes just before `offset`, to detect rewritten files"""
+    header = _csv_header(path)
+    with open(path, 'rb') as f:
+        start = max(len(header), offset - FINGERPRINT_WINDOW)
+        f.seek(start)
+        window = f.read(offset - start)
+    return hashlib.blake2b(header + window, digest_size=16).hexdigest()
+
+
+def read_table_range(table, start, end, schema=None, chunksize=None):
+    """Parse the rows stored in bytes [start, end) of a table's CSV (start must follow a newline)"""
+    schema = TABLE_SCHEMAS[table] if schema is None else schema
+    path = os.path.join(DATA_DIR, CSV_FILES[table])
+    dtype = schema.get('dtype', {})
+    usecols = list(dtype) + list(schema.get('dates', {}))
+    header = _csv_header(path).decode('utf-8')
+    if end <= start:
+        empty = pd.read_csv(io.StringIO(header), usecols=usecols, dtype=dtype)
+        empty = _apply_schema_conversions(empty, schema)
+        return iter(()) if chunksize else empty
+
+    names = next(csv.reader([header]))
+    f = open(path, 'rb')
+    f.seek(start)
+    reader = pd.read_csv(
+        io.BufferedReader(_ByteRange(f, end - start)),
+        header=None, names=names, usecols=usecols, dtype=dtype, chunksize=chunksize
+    )
+    if not chunksize:
+        f.close()
+        return _apply_schema_conversions(reader, schema)
+
+    def chunks():
+        with f, reader:
+            for chunk in reader:
+                yield _apply_schema_conversions(chunk, schema)
+    return chunks()
+
+
+class IncrementalState:
+    """Persisted facts/aggregates for the append-only tables, with a watermark per table.
+
+    A watermark records how many bytes of the CSV have been folded in, the row
+    count and last date seen, and a fingerprint of the bytes before the offset.
+    If a file shrank or its fingerprint changed it was rewritten rather than
+    appended to, and that table is rebuilt from scratch.
+    """
+
+    def __init__(self, state_dir=None):
+        self.state_dir = state_dir or STATE_DIR
+        self.meta = self._load_meta()
+        self._pending = {}
+
+    def _path(self, name):
+        return os.path.join(self.state_dir, name)
+
+    def _load_meta(self):
+        try:
+            with open(self._path('state.json')) as f:
+                meta = json.load(f)
+            if meta.get('version') == STATE_VERSION:
+                return meta
+        except (OSError, ValueError):
+            pass
+        return {'version': STATE_VERSION, 'tables': {}}
+
+    def _resume_offset(self, table, path):
+        """Byte offset to continue a table from, or None when it must be rebuilt"""
+        wm = self.meta['tables'].get(table)
+        if not wm or wm['options'] != _read_options_key(TABLE_SCHEMAS[table]):
+            return None
+        if os.path.getsize(path) < wm['offset'] or _csv_fingerprint(path, wm['offset']) != wm['fingerprint']:
+            print(f"⚠️ {CSV_FILES[table]} was rewritten, rebuilding its incremental state")
+            return None
+        return wm['offset']
+
+    def _watermark(self, table, path, offset, rows, last_date, **extra):
+        self.meta['tables'][table] = {
+            'offset': offset,
+            'fingerprint': _csv_fingerprint(path, offset),
+            'options': _read_options_key(TABLE_SCHEMAS[table]),
+            'rows': int(rows),
+            'last_date': _iso_dates([last_date])[0] if pd.notna(last_date) else None,
+            **extra
+        }
+
+    def extend_table(self, table):
+        """All typed rows of an append-only table: the saved facts plus rows past the watermark"""
+        schema = TABLE_SCHEMAS[table]
+        path = os.path.join(DATA_DIR, CSV_FILES[table])
+        end = os.path.getsize(path)
+        start = self._resume_offset(table, path)
+        facts = None
+        if start is not None:
+            try:
+                facts = _read_npz_snapshot(self._path(f'{table}.npz'))
+            except Exception as e:
+                print(f"⚠️ Could not read saved {table} facts, rebuilding: {e}")
+                start = None
+        if start is None:
+            start = len(_csv_header(path))
+
+        new_rows = read_table_range(table, start, end, schema)
+        if facts is None:
+            facts = new_rows
+        elif len(new_rows):
+            facts = pd.concat([facts, new_rows], ignore_index=True)
+            for col, dt in schema.get('dtype', {}).items():
+                if dt == 'category':
+                    facts[col] = facts[col].astype('category')
+        print(f"   • {table}: {len(new_rows)} new rows past watermark ({len(facts)} total)")
+
+        if len(new_rows) or self.meta['tables'].get(table, {}).get('offset') != end:
+            date_cols = list(schema.get('dates', {}))
+            last_date = facts[date_cols[0]].max() if date_cols and len(facts) else pd.NaT
+            self._watermark(table, path, end, len(facts), last_date)
+            self._pending[f'{table}.npz'] = facts
+        return facts
+
+    def extend_orders(self, chunksize=None):
+        """Order aggregates with the rows appended since the watermark folded in"""
+        path = os.path.join(DATA_DIR, CSV_FILES['orders'])
+        end = os.path.getsize(path)
+        start = self._resume_offset('orders', path)
+        aggs = None
+        if start is not None:
+            try:
+                frames = {name: _read_npz_snapshot(self._path(f'orders_{name}.npz'))
+                          for name in OrderAggregates.FRAMES}
+                aggs = OrderAggregates.from_frames(self.meta['tables']['orders']['count'], frames)
+            except Exception as e:
+                print(f"⚠️ Could not read saved order aggregates, rebuilding: {e}")
+                start = None
+        if start is None:
+            start = len(_csv_header(path))
+            aggs = OrderAggregates()
+
+        before = aggs.count
+        for chunk in read_table_range('orders', start, end, chunksize=chunksize or ORDERS_CHUNK_SIZE):
+            aggs.add(chunk)
+        print(f"   • orders: {aggs.count - before} new rows past watermark ({aggs.count} total)")
+
+        if aggs.count != before or self.meta['tables'].get('orders', {}).get('offset') != end:
+            last_date = aggs.daily_counts.index.get_level_values('order_date').max() if aggs.count else pd.NaT
+            self._watermark('orders', path, end, aggs.count, last_date, count=aggs.count)
+            for name, frame in aggs.to_frames().items():
+                self._pending[f'orders_{name}.npz'] = frame
+        return aggs
+
+    def save(self):
+        """Write changed state files, then the watermarks that point at them"""
+        if not self._pending:
+            return
+        os.makedirs(self.state_dir, exist_ok=True)
+        for name, frame in self._pending.items():
+            tmp_path = self._path(f'{name}.tmp.npz')
+            _write_npz_snapshot(frame, tmp_path)
+            os.replace(tmp_path, self._path(name))
+        tmp_path = self._path('state.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp_path, self._path('state.json'))
+        self._pending = {}
+
+
 def debug_data_merging():
     """Debug function to test data merging step by step"""
     print("🔍 Debugging data merging...")
@@ -125,487 +849,1154 @@ def debug_data_merging():
     print(f"\n📊 Sample of merged data:")
     print(daily.head(5).to_dict('records'))
 
-def load_and_analyze_data():
-    """Load CSV files and calculate key metrics with integrated fixes"""
-    
+DAILY_AMOUNT_COLUMNS = ['revenue', 'expenses', 'profit']
+REVENUE_CATEGORY_COLUMNS = ['food_payment', 'drinks_payment', 'other_payment', 'service_charges', 'delivery_charges']
+EXPENSE_CATEGORY_COLUMNS = ['bills', 'vendors', 'wage_advance', 'repairs', 'sundries']
+
+
+def _country_names(country_id):
+    """Vectorized country_id -> 'UK' / 'India' label"""
+    return np.where(np.asarray(country_id) == 1, 'UK', 'India')
+
+
+def _money(values):
+    """Column of money values rounded to pence as float64"""
+    return np.round(np.asarray(values, dtype='float64'), 2)
+
+
+def _int_column(values):
+    """Column of ids/counts as int64 (raises on missing values, like int() did)"""
+    return pd.Series(values).astype('int64').to_numpy()
+
+
+def _text_column(values, fill=''):
+    return pd.Series(values, dtype=object).fillna(fill).to_numpy()
+
+
+def _records(columns):
+    """JSON-safe list of dicts from equal-length column arrays, converted in bulk.
+
+    `columns` maps output key -> column (ndarray/Series/list); every column is
+    turned into native Python values with a single tolist() call.
+    """
+    keys = list(columns)
+    values = [col if isinstance(col, list) else np.asarray(col).tolist() for col in columns.values()]
+    return [dict(zip(keys, row)) for row in zip(*values)]
+
+
+def _with_iso_dates(columns):
+    """Copy of a column dict with its int 'day' keys swapped for an ISO 'date' column, in place"""
+    return {('date' if key == 'day' else key): (_iso_dates(col) if key == 'day' else col)
+            for key, col in columns.items()}
+
+
+class ColumnRecords:
+    """Row view over equal-length columns, turned into dicts one chunk at a time.
+
+    Used in place of a `_records()` list for the large per-day sections so the
+    JSON writer never holds every row dict at once.
+    """
+
+    def __init__(self, columns):
+        self.columns = {key: col if isinstance(col, list) else np.asarray(col) for key, col in columns.items()}
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), []))
+
+    def __getitem__(self, i):
+        return _records({key: col[i:i + 1] for key, col in self.columns.items()})[0]
+
+    def iter_chunks(self, size):
+        for start in range(0, len(self), size):
+            yield _records({key: col[start:start + size] for key, col in self.columns.items()})
+
+
+def _restaurant_meta(restaurants, clients):
+    """Restaurant id, name, country and client (with its legal name) for the daily facts"""
+    clients_meta = clients[['client_id', 'legal_name']].rename(columns={'legal_name': 'client_name'})
+    rest_meta = restaurants[['id', 'name', 'country_id', 'client_id']].rename(columns={'id': 'restaurant_id'})
+    return rest_meta.merge(clients_meta, on='client_id', how='left')
+
+
+def build_restaurant_days(daily_counts, sales, expenses, rest_meta):
+    """Per restaurant-day facts and per-restaurant totals from order counts, sales and expenses.
+
+    Returns (daily, summary) sorted by restaurant_id (and day). Every row depends on
+    one restaurant only, so it can run on any subset of restaurants.
+    """
+    # Orders per day (keys are int day ordinals parsed at load time)
+    orders_daily = (
+        daily_counts.sort_index()
+        .reset_index(name='orders_count')
+        .rename(columns={'order_date': 'day'})
+    )
+
+    # Revenue per day from sales including category breakdown
+    sales_daily = sales.rename(columns={'date': 'day'})
+    sales_daily['revenue'] = (
+        sales_daily['food_payment'] + sales_daily['drinks_payment'] +
+        sales_daily['other_payment'] + sales_daily['service_charges'] +
+        sales_daily['delivery_charges']
+    )
+    sales_daily = sales_daily[[
+        'restaurant_id', 'day', 'revenue',
+        'food_payment', 'drinks_payment', 'other_payment', 'service_charges', 'delivery_charges'
+    ]]
+
+    # Expenses per day including category breakdown
+    expenses_daily = expenses[[
+        'restaurant_id', 'exp_date', 'amount', 'bills', 'vendors', 'wage_advance', 'repairs', 'sundries'
+    ]].rename(columns={'exp_date': 'day', 'amount': 'expenses'})
+
+    # Merge on (restaurant_id, day key) integers
+    daily = orders_daily.merge(sales_daily, on=['restaurant_id', 'day'], how='left')
+    daily = daily.merge(expenses_daily, on=['restaurant_id', 'day'], how='left')
+    daily['revenue'] = daily['revenue'].fillna(0.0)
+    daily['expenses'] = daily['expenses'].fillna(0.0)
+    # Fill category columns
+    for col in REVENUE_CATEGORY_COLUMNS + EXPENSE_CATEGORY_COLUMNS:
+        if col in daily.columns:
+            daily[col] = daily[col].fillna(0.0)
+    daily['profit'] = daily['revenue'] - daily['expenses']
+
+    # Attach restaurant metadata; orders of restaurants missing from restaurants.csv stay out
+    # of the daily facts (ros_validation reports them) rather than failing the build
+    daily = daily.merge(rest_meta, on='restaurant_id', how='inner')
+
+    summary = daily.groupby(['restaurant_id']).agg(
+        total_orders=('orders_count', 'sum'),
+        total_revenue=('revenue', 'sum'),
+        total_expenses=('expenses', 'sum')
+    ).reset_index()
+    summary['avg_order_value'] = summary['total_revenue'] / summary['total_orders']
+    summary = summary.merge(rest_meta, on='restaurant_id', how='left')
+    return daily, summary
+
+
+# Banking variance anomalies: a day is flagged when its variance is BANKING_ZSCORE_THRESHOLD
+# standard deviations from the restaurant's trailing window (current day excluded), or
+# when it ends a run of at least BANKING_STREAK_DAYS unmatched cash-ups
+BANKING_ZSCORE_WINDOW = 28
+BANKING_ZSCORE_MIN_PERIODS = 7
+BANKING_ZSCORE_THRESHOLD = 3.0
+BANKING_STREAK_DAYS = 3
+ANOMALY_ZSCORE = 1
+ANOMALY_STREAK = 2
+
+
+def build_banking_variance(merged_banking):
+    """Per restaurant-day banking variance with rolling z-scores and unmatched streaks.
+
+    Takes cash-ups joined to banking on banking_id; returns rows sorted by
+    restaurant_id and day with an `anomaly` bitmask (ANOMALY_ZSCORE | ANOMALY_STREAK).
+    Grouped rolling windows and cumulative sums only, no per-restaurant loops.
+    """
+    df = merged_banking[['restaurant_id', 'cash_up_date', 'eod_amount', 'banking_total',
+                         'banked_total', 'is_match']].rename(columns={'cash_up_date': 'day'})
+    df = df[df['day'].notna()].sort_values(['restaurant_id', 'day'], kind='stable').reset_index(drop=True)
+    df['variance'] = df['eod_amount'] - df['banking_total']
+    df['banked_variance'] = df['eod_amount'] - df['banked_total']
+
+    # trailing window of earlier days only, so an outlier can't hide itself
+    by_restaurant = df.groupby('restaurant_id', sort=False)
+    for column, zscore in (('variance', 'zscore'), ('banked_variance', 'banked_zscore')):
+        previous = by_restaurant[column].shift(1)
+        window = previous.groupby(df['restaurant_id'], sort=False).rolling(
+            BANKING_ZSCORE_WINDOW, min_periods=BANKING_ZSCORE_MIN_PERIODS
+        )
+        mean = window.mean().droplevel(0)
+        std = window.std().droplevel(0)
+        df[zscore] = (df[column] - mean) / std.where(std > 0)
+
+    # length of the current run of unmatched cash-ups, restarting per restaurant
+    unmatched = ~df['is_match'].astype(bool).to_numpy()
+    ids = df['restaurant_id'].to_numpy()
+    first = np.r_[True, ids[1:] != ids[:-1]] if len(ids) else np.zeros(0, dtype=bool)
+    running = np.cumsum(unmatched)
+    run_start = np.where(~unmatched, running, np.where(first, running - 1, 0))
+    df['unmatched_streak'] = running - np.maximum.accumulate(run_start) if len(ids) else running
+
+    df['anomaly'] = (
+        np.where((df['zscore'].abs() >= BANKING_ZSCORE_THRESHOLD) |
+                 (df['banked_zscore'].abs() >= BANKING_ZSCORE_THRESHOLD), ANOMALY_ZSCORE, 0) |
+        np.where(df['unmatched_streak'] >= BANKING_STREAK_DAYS, ANOMALY_STREAK, 0)
+    ).astype('int8')
+    return df
+
+
+# Sharded aggregation: every per-restaurant aggregate is independent, so with
+# --workers N the operational tables are hash-partitioned by restaurant_id and the
+# per-restaurant-day pipeline runs in a process pool. Partial results are put back
+# in restaurant order, so the output is identical to a single-process run.
+WORKERS = 1
+
+
+def _partition_by_restaurant(data, n):
+    """Split a frame (restaurant_id column) or a Series (restaurant_id index level) into n shards"""
+    if isinstance(data, pd.Series):
+        ids = data.index.get_level_values('restaurant_id')
+    else:
+        ids = data['restaurant_id']
+    shard = np.asarray(ids, dtype='int64') % n
+    positions = pd.Series(np.arange(len(shard))).groupby(shard).indices
+    return [data.iloc[positions.get(i, np.array([], dtype='int64'))] for i in range(n)]
+
+
+def _restaurant_shard(orders, sales, expenses, rest_meta):
+    """One shard: order aggregates when given raw orders, plus its restaurant-day facts"""
+    if isinstance(orders, pd.DataFrame):
+        aggs = OrderAggregates.from_frame(orders)
+        daily_counts = aggs.daily_counts
+    else:
+        aggs, daily_counts = None, orders
+    return aggs, build_restaurant_days(daily_counts, sales, expenses, rest_meta)
+
+
+def _concat_shards(frames, sort_by):
+    non_empty = [frame for frame in frames if len(frame)] or frames[:1]
+    return pd.concat(non_empty, ignore_index=True).sort_values(sort_by, kind='stable', ignore_index=True)
+
+
+def aggregate_by_restaurant(orders, sales, expenses, rest_meta, workers):
+    """Run build_restaurant_days over `workers` restaurant shards in a process pool.
+
+    `orders` is either the raw orders frame (aggregated inside the shards) or the
+    daily counts of existing OrderAggregates. Returns (merged OrderAggregates or
+    None, (daily, summary)).
+    """
+    shards = zip(*(_partition_by_restaurant(data, workers) for data in (orders, sales, expenses)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_pool_worker,
+                             initargs=(_pool_config(),)) as pool:
+        futures = [pool.submit(_restaurant_shard, o, s, e, rest_meta) for o, s, e in shards]
+        results = [future.result() for future in futures]
+
+    aggs = None
+    if isinstance(orders, pd.DataFrame):
+        aggs = OrderAggregates()
+        for part, _ in results:
+            aggs.merge(part)
+    daily = _concat_shards([days for _, (days, _) in results], ['restaurant_id', 'day'])
+    summary = _concat_shards([totals for _, (_, totals) in results], ['restaurant_id'])
+    return aggs, (daily, summary)
+
+
+# Stage spans (--profile); spans cost next to nothing until the profiler is enabled.
+# Every span records rows_in and rows_out; stages that only compute scalars count the
+# metric values they read and write.
+PROFILER = StageProfiler()
+
+
+def _table_rows(tables):
+    """Rows across loaded tables (orders counted from their aggregates)"""
+    return sum(value.count if isinstance(value, OrderAggregates) else len(value) for value in tables.values())
+
+
+def _section_rows(section):
+    """Rows of an output section: a record list/ColumnRecords or a {column: values} dict"""
+    if isinstance(section, dict):
+        return len(next(iter(section.values()), []))
+    return len(section)
+
+
+def _metric_values(metrics, keys):
+    """How many of these metric keys are set"""
+    return sum(1 for key in keys if key in metrics)
+
+
+DIMENSION_TABLES = ('clients', 'restaurants', 'users', 'subscriptions')
+
+
+def _load_incremental(state, table, rejects=None):
+    if table in DIMENSION_TABLES:
+        return load_table(table, rejects=rejects)
+    return state.extend_orders() if table == 'orders' else state.extend_table(table)
+
+
+def _pruned_schema(table, columns):
+    """The table's TABLE_SCHEMAS entry restricted to `columns` (None keeps them all)"""
+    schema = TABLE_SCHEMAS[table]
+    if columns is None:
+        return schema
+    pruned = {'dtype': {col: dt for col, dt in schema['dtype'].items() if col in columns}}
+    if 'dates' in schema:
+        pruned['dates'] = {col: fmt for col, fmt in schema['dates'].items() if col in columns}
+    if 'pence' in schema:
+        pruned['pence'] = [col for col in schema['pence'] if col in columns]
+    return pruned
+
+
+def _load_columns(table, columns, rejects=None):
+    """One table for a partial run: whole tables as usual, pruned ones parsed straight from the CSV
+    (pruned reads bypass the snapshot cache so they never replace the full snapshot)"""
+    schema = _pruned_schema(table, columns)
+    if table == 'orders' or schema == TABLE_SCHEMAS[table]:
+        return _load_for_analysis(table, rejects)
+    return read_table_csv(table, schema, rejects)
+
+
+def load_ros_tables(incremental=None, workers=None, columns=None, rejects=None):
+    """Load and type every table once; None if the files can't be read.
+
+    `columns` ({table: column list or None}, see metric_plan()) loads only those tables and columns.
+    Rows rejected while parsing are added to `rejects` ({table: rows}) for validate_loaded_tables().
+    """
+
     print("🔄 Loading ROS data files...")
-    
-    # Load all CSV files
-    try:
-        clients = pd.read_csv('csv_data/clients.csv')
-        restaurants = pd.read_csv('csv_data/restaurants.csv')
-        users = pd.read_csv('csv_data/users.csv')
-        subscriptions = pd.read_csv('csv_data/subscriptions.csv')
-        
-        # Load operational data (FULL DATASET)
-        orders = pd.read_csv('csv_data/orders.csv')
-        sales = pd.read_csv('csv_data/sales.csv')
-        expenses = pd.read_csv('csv_data/expenses.csv')
-        cashup = pd.read_csv('csv_data/cashup.csv')
-        banking = pd.read_csv('csv_data/banking.csv')
-        
-        print("✅ Data files loaded successfully")
-        print(f"📊 Loaded: {len(orders)} orders, {len(sales)} sales, {len(expenses)} expenses")
-        
-    except Exception as e:
-        print(f"❌ Error loading data: {e}")
-        return None
-    
-    # Normalize key column types to ensure reliable joins/mapping
-    try:
-        # Strip whitespace from column names across all loaded dataframes
-        for df in [clients, restaurants, users, subscriptions, orders, sales, expenses, cashup, banking]:
-            df.columns = df.columns.str.strip()
-
-        if 'subscription_id' in subscriptions.columns:
-            subscriptions['subscription_id'] = pd.to_numeric(subscriptions['subscription_id'], errors='coerce').fillna(0).astype(int)
-        if 'no_of_users' in subscriptions.columns:
-            subscriptions['no_of_users'] = pd.to_numeric(subscriptions['no_of_users'], errors='coerce').fillna(0).astype(int)
-        if 'cost' in subscriptions.columns:
-            subscriptions['cost'] = pd.to_numeric(subscriptions['cost'], errors='coerce').fillna(0.0).astype(float)
-
-        if 'subscription_id' in clients.columns:
-            clients['subscription_id'] = pd.to_numeric(clients['subscription_id'], errors='coerce')
-        # Ensure id columns are integers where possible
-        for df, col in [
-            (clients, 'client_id'), (restaurants, 'id'), (restaurants, 'client_id'),
-            (users, 'client_id'), (users, 'restaurant_id')
-        ]:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-    except Exception as e:
-        print(f"⚠️ Type normalization warning: {e}")
+    if incremental is None:
+        incremental = INCREMENTAL
+    workers = WORKERS if workers is None else workers
+    rejects = {} if rejects is None else rejects
 
-    # Calculate key metrics
-    metrics = {}
-    
+    # Load all CSV files concurrently (operational data is the FULL DATASET)
+    with PROFILER.span('load') as span:
+        try:
+            if columns is not None:
+                loaded = load_tables(list(columns), process_tables=(), rejects=rejects,
+                                     loader=lambda table, rejects: _load_columns(table, columns[table], rejects))
+            elif incremental:
+                # Append-only tables: saved state plus rows past each watermark
+                state = IncrementalState()
+                loaded = load_tables(CSV_FILES, process_tables=(), rejects=rejects,
+                                     loader=lambda table, rejects: _load_incremental(state, table, rejects))
+                state.save()
+            elif workers > 1 and not STREAM_ORDERS:
+                # raw orders; they are aggregated inside the restaurant shards below
+                loaded = load_tables(CSV_FILES, loader=load_table, rejects=rejects)
+            else:
+                loaded = load_tables(CSV_FILES, rejects=rejects)
+        except Exception as e:
+            print(f"❌ Error loading data: {e}")
+            return None
+        span.rows_out = _table_rows(loaded)
+        # rows read from the CSVs, including the ones rejected while parsing
+        span.rows_in = span.rows_out + sum(len(rows) for table, rows in rejects.items() if table in loaded)
+    return loaded
+
+
+# Validation: rows failing the ros_validation checks are set aside in this report
+QUARANTINE_FILE = 'ros_quarantine_report.json'
+
+
+def validate_loaded_tables(tables, columns=None, report_path=None, rejects=None):
+    """load_ros_tables() output without the rows that fail validation (the input dict is untouched).
+
+    `rejects` are the rows load_ros_tables() couldn't parse. Full loads write the quarantine
+    report to `report_path` (QUARANTINE_FILE by default); a partial load (`columns`) only
+    checks what it read and writes nothing.
+    """
+    schemas = {table: _pruned_schema(table, (columns or {}).get(table)) for table in tables}
+    rejected = sum(len(rows) for table, rows in (rejects or {}).items() if table in tables)
+    with PROFILER.span('validate', rows_in=_table_rows(tables) + rejected) as span:
+        tables, report = validate_tables(tables, schemas, rejects)
+        span.rows_out = _table_rows(tables)
+        span.set(quarantined_rows=report['quarantined_rows'])
+    issues = [f"{check['count']} {check['table']} {check['check']}" for check in report['checks']]
+    issues += [f"{issue['table']}.{issue['column']} is {issue['found']}" for issue in report['schema']]
+    issues += [f"{skipped['table']} {skipped['check']} skipped ({skipped['reason']})" for skipped in report['skipped']]
+    if issues:
+        print(f"⚠️ Validation: {', '.join(issues)} - {report['quarantined_rows']} rows quarantined")
+    if columns is None:
+        report_path = report_path or QUARANTINE_FILE
+        save_quarantine_report(report, report_path)
+        if issues:
+            print(f"🧪 Quarantine report saved to {report_path}")
+    return tables
+
+
+class AnalysisStage:
+    """One section of analyze_tables(): the table columns it reads (None for a whole table),
+    the stages whose metrics it reads (`after`) and the metric keys it writes"""
+
+    def __init__(self, name, func, columns, after, outputs):
+        self.name = name
+        self.func = func
+        self.columns = {table: None if cols is None else tuple(cols) for table, cols in columns.items()}
+        self.tables = tuple(self.columns)
+        self.after = tuple(after)
+        self.outputs = tuple(outputs)
+
+
+# Stage dependency graph, in run order; see affected_stages()
+ANALYSIS_STAGES = {}
+
+
+def analysis_stage(name, columns=None, after=(), outputs=()):
+    """Register a metric stage; its upstream stages and input columns must already exist"""
+    columns = columns or {}
+
+    def register(func):
+        missing = [stage for stage in after if stage not in ANALYSIS_STAGES]
+        for table, cols in columns.items():
+            known = set(TABLE_SCHEMAS[table]['dtype']) | set(TABLE_SCHEMAS[table].get('dates', {}))
+            missing += [f'{table}.{col}' for col in cols or () if col not in known]
+        if missing:
+            raise ValueError(f"stage '{name}' reads unknown stages/columns {missing}")
+        ANALYSIS_STAGES[name] = AnalysisStage(name, func, columns, after, outputs)
+        return func
+    return register
+
+
+def metric_plan(names):
+    """(stages in run order, {table: columns}) needed for these metric keys or stage names"""
+    owners = {key: stage.name for stage in ANALYSIS_STAGES.values() for key in stage.outputs}
+    unknown = [name for name in names if name not in ANALYSIS_STAGES and name not in owners]
+    if unknown:
+        raise ValueError(f"unknown metrics {unknown}; choose from {sorted(owners)} or stages {list(ANALYSIS_STAGES)}")
+    wanted = {owners.get(name, name) for name in names}
+    # upstream stages, walked from the end so each stage adds what it runs after
+    for name in reversed(list(ANALYSIS_STAGES)):
+        if name in wanted:
+            wanted.update(ANALYSIS_STAGES[name].after)
+    stages = [name for name in ANALYSIS_STAGES if name in wanted]
+
+    columns = {}
+
+    def need(table, cols):
+        """Add columns to a table's load; True if that changed the plan"""
+        before = columns.get(table, False)
+        if cols is None or before is None:
+            columns[table] = None
+        else:
+            columns[table] = tuple(dict.fromkeys((before or ()) + tuple(cols)))
+        return columns[table] != before
+
+    for name in stages:
+        for table, cols in ANALYSIS_STAGES[name].columns.items():
+            need(table, cols)
+    # validation quarantines the same rows as a full run only if every loaded table brings
+    # its key and id columns, and the tables those ids point at (which bring theirs)
+    changed = True
+    while changed:
+        changed = False
+        for table in list(columns):
+            changed |= need(table, TABLE_KEYS.get(table, ()))
+        for table, col, parent, parent_key, _ in FOREIGN_KEYS:
+            if table in columns:
+                changed |= need(table, [col])
+                changed |= need(parent, [parent_key])
+    return stages, columns
+
+
+def affected_stages(changed_tables):
+    """Stages reading any of these tables, plus every stage downstream of them (run order)"""
+    changed_tables = set(changed_tables)
+    affected = []
+    for name, stage in ANALYSIS_STAGES.items():
+        if changed_tables.intersection(stage.tables) or any(up in affected for up in stage.after):
+            affected.append(name)
+    return affected
+
+
+@analysis_stage('overview', columns={'clients': ['is_active'], 'restaurants': ['country_id']},
+                outputs=('total_clients', 'total_restaurants', 'uk_restaurants', 'india_restaurants',
+                         'active_clients', 'inactive_clients'))
+def _overview_stage(tables, metrics, context):
+    clients, restaurants = tables['clients'], tables['restaurants']
     # 1. Basic counts
-    metrics['total_clients'] = len(clients)
-    metrics['total_restaurants'] = len(restaurants)
-    metrics['total_users'] = len(users)
-    metrics['total_orders'] = len(orders)
-    
-    # 2. Geographic distribution
-    uk_restaurants = len(restaurants[restaurants['country_id'] == 1])
-    india_restaurants = len(restaurants[restaurants['country_id'] == 2])
-    metrics['uk_restaurants'] = uk_restaurants
-    metrics['india_restaurants'] = india_restaurants
-    
-    # 3. Client status analysis
-    active_clients = len(clients[clients['is_active'] == True])
-    inactive_clients = len(clients[clients['is_active'] == False])
-    metrics['active_clients'] = active_clients
-    metrics['inactive_clients'] = inactive_clients
-    
+    with PROFILER.span('overview', rows_in=len(clients) + len(restaurants)) as span:
+        metrics['total_clients'] = len(clients)
+        metrics['total_restaurants'] = len(restaurants)
+
+        # 2. Geographic distribution
+        uk_restaurants = len(restaurants[restaurants['country_id'] == 1])
+        india_restaurants = len(restaurants[restaurants['country_id'] == 2])
+        metrics['uk_restaurants'] = uk_restaurants
+        metrics['india_restaurants'] = india_restaurants
+
+        # 3. Client status analysis
+        active_clients = len(clients[clients['is_active'] == True])
+        inactive_clients = len(clients[clients['is_active'] == False])
+        metrics['active_clients'] = active_clients
+        metrics['inactive_clients'] = inactive_clients
+        span.rows_out = _metric_values(metrics, ANALYSIS_STAGES['overview'].outputs)
+
+
+@analysis_stage('subscriptions',
+                columns={'clients': ['client_id', 'legal_name', 'subscription_id'], 'users': ['client_id'],
+                         'subscriptions': ['subscription_id', 'subscription_name', 'cost', 'no_of_users']},
+                outputs=('subscription_analysis', 'client_subscription_utilization'))
+def _subscriptions_stage(tables, metrics, context):
+    clients, users, subscriptions = tables['clients'], tables['users'], tables['subscriptions']
     # 4. Subscription analysis with proper mapping
-    print("📋 Processing subscription data...")
-    subscription_map = {}
-    for _, sub in subscriptions.iterrows():
-        subscription_map[int(sub['subscription_id'])] = sub['subscription_name']
-    
-    metrics['subscription_analysis'] = []
-    client_subscription_utilization = []
-    
-    for _, sub in subscriptions.iterrows():
-        users_on_sub = len(users[users.get('client_id', pd.Series()).isin(
-            clients[clients['subscription_id'] == sub['subscription_id']]['client_id']
-        )])
-        metrics['subscription_analysis'].append({
-            'name': sub['subscription_name'],
-            'cost': sub['cost'],
-            'max_users': sub['no_of_users'],
-            'current_users': users_on_sub,
-            'utilization': round((users_on_sub / sub['no_of_users']) * 100, 1) if sub['no_of_users'] > 0 else 0
+    with PROFILER.span('subscriptions', rows_in=len(clients) + len(users) + len(subscriptions)) as span:
+        print("📋 Processing subscription data...")
+        # users -> clients -> subscriptions, joined once and counted with groupby;
+        # limits are looked up by subscription_id, not by row position
+        client_subs = clients[['client_id', 'legal_name', 'subscription_id']].drop_duplicates('client_id')
+        users_per_client = users.groupby('client_id', observed=True).size()
+        user_subs = users[['client_id']].merge(client_subs[['client_id', 'subscription_id']], on='client_id', how='inner')
+        users_per_sub = user_subs.groupby('subscription_id', observed=True).size()
+        subs_by_id = subscriptions.drop_duplicates('subscription_id').set_index('subscription_id')
+
+        def utilization_pct(current, limit):
+            limit = np.asarray(limit, dtype='float64')
+            return np.round(np.divide(current, limit, out=np.zeros(len(limit)), where=limit > 0) * 100, 1)
+
+        sub_users = subscriptions['subscription_id'].map(users_per_sub).fillna(0).astype('int64')
+        metrics['subscription_analysis'] = _records({
+            'name': subscriptions['subscription_name'],
+            'cost': subscriptions['cost'],
+            'max_users': _int_column(subscriptions['no_of_users']),
+            'current_users': sub_users,
+            'utilization': utilization_pct(sub_users, subscriptions['no_of_users'])
         })
 
-    # per-client subscription utilization
-    try:
-        for _, cl in clients.iterrows():
-            raw_sid = cl['subscription_id'] if 'subscription_id' in cl else None
-            sub_id = int(raw_sid) if pd.notna(raw_sid) else None
-            max_users = int(subscriptions.loc[sub_id, 'no_of_users']) if sub_id is not None and sub_id in subscriptions.index else 0
-            sub_name = subscription_map.get(sub_id, '')
-            cur_users = int(len(users[users['client_id'] == cl['client_id']])) if 'client_id' in users.columns else 0
-            utilization = round((cur_users / max_users) * 100, 1) if max_users > 0 else 0
-            client_subscription_utilization.append({
-                'client_id': int(cl['client_id']),
-                'client_name': cl['legal_name'],
-                'subscription_id': int(sub_id),
-                'subscription_name': sub_name,
-                'max_users': int(max_users),
-                'current_users': int(cur_users),
-                'utilization': utilization
-            })
-    except Exception as e:
-        print(f"⚠️ Could not compute client subscription utilization: {e}")
-    
-    metrics['client_subscription_utilization'] = client_subscription_utilization
-    
-    # 5. Order analysis (FULL DATA)
-    if not orders.empty:
-        metrics['avg_order_value'] = round(orders['order_total'].mean(), 2)
-        metrics['avg_food_amount'] = round(orders['food_amount'].mean(), 2)
-        metrics['avg_drinks_amount'] = round(orders['drinks_amount'].mean(), 2)
-        
-        # Order type distribution
-        order_type_dist = orders['order_type'].value_counts()
-        metrics['order_type_distribution'] = order_type_dist.to_dict()
-        
-        # Calculate delivery vs dine-in metrics
-        delivery_orders = orders[orders['order_type'] == 'Home Delivery']
-        dine_in_orders = orders[orders['order_type'] == 'Dine-in']
-        
-        if not delivery_orders.empty:
-            metrics['avg_delivery_value'] = round(delivery_orders['order_total'].mean(), 2)
-        if not dine_in_orders.empty:
-            metrics['avg_dine_in_value'] = round(dine_in_orders['order_total'].mean(), 2)
-    
+        # per-client subscription utilization
+        client_users = client_subs['client_id'].map(users_per_client).fillna(0).astype('int64')
+        client_limit = client_subs['subscription_id'].map(subs_by_id['no_of_users']).fillna(0).astype('int64')
+        metrics['client_subscription_utilization'] = _records({
+            'client_id': _int_column(client_subs['client_id']),
+            'client_name': client_subs['legal_name'],
+            'subscription_id': _nullable_column(client_subs['subscription_id']),
+            'subscription_name': client_subs['subscription_id'].map(subs_by_id['subscription_name']).fillna(''),
+            'max_users': client_limit,
+            'current_users': client_users,
+            'utilization': utilization_pct(client_users, client_limit)
+        })
+        span.rows_out = len(metrics['subscription_analysis']) + len(metrics['client_subscription_utilization'])
+
+
+@analysis_stage('orders', columns={'orders': None},
+                outputs=('total_orders', 'avg_order_value', 'avg_food_amount', 'avg_drinks_amount',
+                         'order_type_distribution', 'avg_delivery_value', 'avg_dine_in_value',
+                         'order_value_distribution'))
+def _orders_stage(tables, metrics, context):
+    order_aggs = tables['orders']
+    # 5. Order analysis (FULL DATA) - order money is held in pence
+    with PROFILER.span('orders', rows_in=order_aggs.count) as span:
+        metrics['total_orders'] = order_aggs.count
+        if order_aggs.count:
+            metrics['avg_order_value'] = round(order_aggs.mean_amount('order_total'), 2)
+            metrics['avg_food_amount'] = round(order_aggs.mean_amount('food_amount'), 2)
+            metrics['avg_drinks_amount'] = round(order_aggs.mean_amount('drinks_amount'), 2)
+
+            # Order type distribution
+            order_type_dist = order_aggs.type_counts.sort_index().sort_values(ascending=False, kind='stable')
+            metrics['order_type_distribution'] = order_type_dist.to_dict()
+
+            # Calculate delivery vs dine-in metrics
+            if order_aggs.type_counts.get('Home Delivery', 0):
+                metrics['avg_delivery_value'] = round(order_aggs.mean_total_for_type('Home Delivery'), 2)
+            if order_aggs.type_counts.get('Dine-in', 0):
+                metrics['avg_dine_in_value'] = round(order_aggs.mean_total_for_type('Dine-in'), 2)
+
+            # Order value percentiles and distinct orders from the mergeable sketches
+            metrics['order_value_distribution'] = order_aggs.sketches.distribution()
+        span.rows_out = _metric_values(metrics, ANALYSIS_STAGES['orders'].outputs)
+
+
+@analysis_stage('sales', columns={'sales': REVENUE_CATEGORY_COLUMNS},
+                outputs=('total_revenue', 'revenue_breakdown', 'avg_daily_revenue'))
+def _sales_stage(tables, metrics, context):
+    sales = tables['sales']
     # 6. Sales analysis
-    if not sales.empty:
-        total_revenue = sales[['food_payment', 'drinks_payment', 'other_payment', 'service_charges', 'delivery_charges']].sum().sum()
-        metrics['total_revenue'] = round(total_revenue, 2)
-        
-        # Revenue breakdown
-        metrics['revenue_breakdown'] = {
-            'food_revenue': round(sales['food_payment'].sum(), 2),
-            'drinks_revenue': round(sales['drinks_payment'].sum(), 2),
-            'other_revenue': round(sales['other_payment'].sum(), 2),
-            'service_charges': round(sales['service_charges'].sum(), 2),
-            'delivery_charges': round(sales['delivery_charges'].sum(), 2)
-        }
-        
-        # Daily average revenue
-        metrics['avg_daily_revenue'] = round(total_revenue / len(sales), 2)
-    
+    with PROFILER.span('sales', rows_in=len(sales)) as span:
+        if not sales.empty:
+            total_revenue = sales[['food_payment', 'drinks_payment', 'other_payment', 'service_charges', 'delivery_charges']].sum().sum()
+            metrics['total_revenue'] = round(total_revenue, 2)
+
+            # Revenue breakdown
+            metrics['revenue_breakdown'] = {
+                'food_revenue': round(sales['food_payment'].sum(), 2),
+                'drinks_revenue': round(sales['drinks_payment'].sum(), 2),
+                'other_revenue': round(sales['other_payment'].sum(), 2),
+                'service_charges': round(sales['service_charges'].sum(), 2),
+                'delivery_charges': round(sales['delivery_charges'].sum(), 2)
+            }
+
+            # Daily average revenue
+            metrics['avg_daily_revenue'] = round(total_revenue / len(sales), 2)
+        span.rows_out = _metric_values(metrics, ANALYSIS_STAGES['sales'].outputs)
+
+
+@analysis_stage('expenses', columns={'expenses': ['amount'] + EXPENSE_CATEGORY_COLUMNS},
+                outputs=('total_expenses', 'expense_breakdown', 'avg_daily_expenses', 'expense_volatility'))
+def _expenses_stage(tables, metrics, context):
+    expenses = tables['expenses']
     # 7. Expense analysis
-    if not expenses.empty:
-        total_expenses = expenses['amount'].sum()
-        metrics['total_expenses'] = round(total_expenses, 2)
-        
-        # Expense breakdown
-        metrics['expense_breakdown'] = {
-            'bills': round(expenses['bills'].sum(), 2),
-            'vendors': round(expenses['vendors'].sum(), 2),
-            'wage_advance': round(expenses['wage_advance'].sum(), 2),
-            'repairs': round(expenses['repairs'].sum(), 2),
-            'sundries': round(expenses['sundries'].sum(), 2)
-        }
-        
-        # Average daily expenses
-        metrics['avg_daily_expenses'] = round(total_expenses / len(expenses), 2)
-        
-        # Expense volatility
-        metrics['expense_volatility'] = {
-            'repairs_std': round(expenses['repairs'].std(), 2),
-            'bills_std': round(expenses['bills'].std(), 2),
-            'wage_std': round(expenses['wage_advance'].std(), 2)
-        }
+    with PROFILER.span('expenses', rows_in=len(expenses)) as span:
+        if not expenses.empty:
+            total_expenses = expenses['amount'].sum()
+            metrics['total_expenses'] = round(total_expenses, 2)
+
+            # Expense breakdown
+            metrics['expense_breakdown'] = {
+                'bills': round(expenses['bills'].sum(), 2),
+                'vendors': round(expenses['vendors'].sum(), 2),
+                'wage_advance': round(expenses['wage_advance'].sum(), 2),
+                'repairs': round(expenses['repairs'].sum(), 2),
+                'sundries': round(expenses['sundries'].sum(), 2)
+            }
+
+            # Average daily expenses
+            metrics['avg_daily_expenses'] = round(total_expenses / len(expenses), 2)
+
+            # Expense volatility
+            metrics['expense_volatility'] = {
+                'repairs_std': round(expenses['repairs'].std(), 2),
+                'bills_std': round(expenses['bills'].std(), 2),
+                'wage_std': round(expenses['wage_advance'].std(), 2)
+            }
+        span.rows_out = _metric_values(metrics, ANALYSIS_STAGES['expenses'].outputs)
+
+
+def _fallback_restaurant_summary(restaurants, clients=None, order_aggs=None, sales=None, expenses=None):
+    """restaurants_summary records when the daily dataset can't be built: every restaurant,
+    with totals from whichever of orders, sales and expenses are given (zeros otherwise)"""
+    summary = restaurants[['id', 'name', 'country_id', 'client_id']].rename(columns={'id': 'restaurant_id'})
+    rest_ids = summary['restaurant_id']
+    client_names = pd.Series(dtype=object)
+    if clients is not None and not clients.empty:
+        client_names = clients.drop_duplicates('client_id').set_index('client_id')['legal_name']
+
+    total_orders = pd.Series(0, index=rest_ids.to_numpy(), dtype='int64')
+    if order_aggs is not None and order_aggs.count:
+        total_orders = order_aggs.restaurant_counts.reindex(rest_ids.to_numpy(), fill_value=0)
+    total_revenue = np.zeros(len(summary))
+    if sales is not None and not sales.empty:
+        revenue = sales[REVENUE_CATEGORY_COLUMNS].sum(axis=1).groupby(sales['restaurant_id']).sum()
+        total_revenue = rest_ids.map(revenue).fillna(0.0).to_numpy(dtype='float64')
+    total_expenses = np.zeros(len(summary))
+    if expenses is not None and not expenses.empty:
+        spent = expenses.groupby('restaurant_id')['amount'].sum()
+        total_expenses = rest_ids.map(spent).fillna(0.0).to_numpy(dtype='float64')
 
+    total_orders = total_orders.to_numpy(dtype='int64')
+    avg_order_value = np.divide(total_revenue, total_orders, out=np.zeros(len(summary)), where=total_orders > 0)
+    return _records({
+        'restaurant_id': _int_column(rest_ids),
+        'name': summary['name'],
+        'country': _country_names(summary['country_id']),
+        'client_id': _nullable_column(summary['client_id']),
+        'client_name': _text_column(summary['client_id'].map(client_names)),
+        'total_orders': total_orders,
+        'total_revenue': _money(total_revenue),
+        'total_expenses': _money(total_expenses),
+        'profit': _money(total_revenue - total_expenses),
+        'avg_order_value': _money(avg_order_value)
+    })
+
+
+@analysis_stage('daily_dataset',
+                columns={'orders': None, 'sales': None, 'expenses': None,
+                         'restaurants': ['id', 'name', 'country_id', 'client_id'], 'clients': ['client_id', 'legal_name']},
+                outputs=('per_restaurant_daily', 'per_restaurant_daily_columns', 'restaurants_summary'))
+def _daily_dataset_stage(tables, metrics, context):
+    clients, restaurants, order_aggs = tables['clients'], tables['restaurants'], tables['orders']
+    sales, expenses = tables['sales'], tables['expenses']
     # 7b. Build per-restaurant per-day dataset for dashboard tables and date filtering
-    per_restaurant_daily_records = []
-    restaurants_summary_records = []
-    
-    print("📊 Building per-restaurant daily dataset...")
-    try:
-        # Normalize dates - handle different formats
-        print("📅 Normalizing dates...")
-        orders['order_date'] = pd.to_datetime(orders['order_date'], format='%d-%m-%Y', errors='coerce').dt.date
-        sales['date'] = pd.to_datetime(sales['date'], errors='coerce').dt.date  # Already in YYYY-MM-DD format
-        expenses['exp_date'] = pd.to_datetime(expenses['exp_date'], errors='coerce').dt.date  # Already in YYYY-MM-DD format
-
-        # Orders per day
-        print("📊 Processing orders...")
-        orders_daily = (
-            orders.groupby(['restaurant_id', 'order_date'])
-            .size()
-            .reset_index(name='orders_count')
-            .rename(columns={'order_date': 'date'})
-        )
+    with PROFILER.span('daily_dataset', rows_in=len(sales) + len(expenses)) as span:
+        per_restaurant_daily_records = []
+        restaurants_summary_records = []
 
-        # Revenue per day from sales including category breakdown
-        print("💰 Processing sales...")
-        sales_daily = sales.copy()
-        sales_daily['revenue'] = (
-            sales_daily['food_payment'] + sales_daily['drinks_payment'] +
-            sales_daily['other_payment'] + sales_daily['service_charges'] +
-            sales_daily['delivery_charges']
-        )
-        sales_daily = sales_daily[[
-            'restaurant_id', 'date', 'revenue',
-            'food_payment', 'drinks_payment', 'other_payment', 'service_charges', 'delivery_charges'
-        ]]
-
-        # Expenses per day including category breakdown
-        print("💸 Processing expenses...")
-        expenses_daily = expenses[[
-            'restaurant_id', 'exp_date', 'amount', 'bills', 'vendors', 'wage_advance', 'repairs', 'sundries'
-        ]].rename(columns={'exp_date': 'date', 'amount': 'expenses'})
-
-        # Ensure all date columns are the same type (string) for merging
-        print("🔗 Merging data...")
-        orders_daily['date'] = orders_daily['date'].astype(str)
-        sales_daily['date'] = sales_daily['date'].astype(str)
-        expenses_daily['date'] = expenses_daily['date'].astype(str)
-
-        # Merge
-        daily = orders_daily.merge(sales_daily, on=['restaurant_id', 'date'], how='left')
-        daily = daily.merge(expenses_daily, on=['restaurant_id', 'date'], how='left')
-        daily['revenue'] = daily['revenue'].fillna(0.0)
-        daily['expenses'] = daily['expenses'].fillna(0.0)
-        # Fill category columns
-        for col in ['food_payment','drinks_payment','other_payment','service_charges','delivery_charges',
-                    'bills','vendors','wage_advance','repairs','sundries']:
-            if col in daily.columns:
-                daily[col] = daily[col].fillna(0.0)
-        daily['profit'] = daily['revenue'] - daily['expenses']
-
-        # Attach restaurant metadata
-        print("🏢 Adding metadata...")
-        clients_meta = clients[['client_id', 'legal_name']].rename(columns={'legal_name': 'client_name'})
-        rest_meta = restaurants[['id', 'name', 'country_id', 'client_id']].rename(columns={'id': 'restaurant_id'})
-        rest_meta = rest_meta.merge(clients_meta, on='client_id', how='left')
-        daily = daily.merge(rest_meta, on='restaurant_id', how='left')
-
-        # Build records with JSON-safe types
-        print("📝 Building daily records...")
-        for _, row in daily.iterrows():
-            per_restaurant_daily_records.append({
-                'restaurant_id': int(row['restaurant_id']),
-                'name': row['name'],
-                'country': 'UK' if int(row['country_id']) == 1 else 'India',
-                'date': str(row['date']),
-                'orders': int(row['orders_count']),
-                'revenue': round(float(row['revenue']), 2),
-                'expenses': round(float(row['expenses']), 2),
-                'profit': round(float(row['profit']), 2),
-                'client_id': int(row['client_id']),
-                'client_name': row['client_name'] if pd.notna(row['client_name']) else '',
-                # revenue categories
-                'food_payment': round(float(row.get('food_payment', 0.0)), 2),
-                'drinks_payment': round(float(row.get('drinks_payment', 0.0)), 2),
-                'other_payment': round(float(row.get('other_payment', 0.0)), 2),
-                'service_charges': round(float(row.get('service_charges', 0.0)), 2),
-                'delivery_charges': round(float(row.get('delivery_charges', 0.0)), 2),
-                # expense categories
-                'bills': round(float(row.get('bills', 0.0)), 2),
-                'vendors': round(float(row.get('vendors', 0.0)), 2),
-                'wage_advance': round(float(row.get('wage_advance', 0.0)), 2),
-                'repairs': round(float(row.get('repairs', 0.0)), 2),
-                'sundries': round(float(row.get('sundries', 0.0)), 2),
-            })
+        print("📊 Building per-restaurant daily dataset...")
+        try:
+            restaurant_days = context.get('restaurant_days')
+            if restaurant_days is None:
+                print("🔗 Merging orders, sales and expenses per restaurant-day...")
+                rest_meta = _restaurant_meta(restaurants, clients)
+                restaurant_days = build_restaurant_days(order_aggs.daily_counts, sales, expenses, rest_meta)
+            daily, summary = restaurant_days
+
+            # Build records with JSON-safe types (column-wise, one bulk conversion)
+            print("📝 Building daily records...")
+            daily_columns = {
+                'restaurant_id': _int_column(daily['restaurant_id']),
+                'name': daily['name'],
+                'country': _country_names(_int_column(daily['country_id'])),
+                'day': daily['day'].to_numpy(dtype='int32'),
+                'orders': _int_column(daily['orders_count']),
+                'revenue': _money(daily['revenue']),
+                'expenses': _money(daily['expenses']),
+                'profit': _money(daily['profit']),
+                'client_id': _int_column(daily['client_id']),
+                'client_name': _text_column(daily['client_name'])
+            }
+            # revenue and expense categories
+            for col in REVENUE_CATEGORY_COLUMNS + EXPENSE_CATEGORY_COLUMNS:
+                daily_columns[col] = _money(daily[col]) if col in daily.columns else np.zeros(len(daily))
+            per_restaurant_daily_records = ColumnRecords(_with_iso_dates(daily_columns))
+            metrics['per_restaurant_daily_columns'] = daily_columns
 
-        # Restaurant-level summary across selected period (full year here)
-        print("📊 Building restaurant summary...")
-        summary = daily.groupby(['restaurant_id']).agg(
-            total_orders=('orders_count', 'sum'),
-            total_revenue=('revenue', 'sum'),
-            total_expenses=('expenses', 'sum')
-        ).reset_index()
-        summary['avg_order_value'] = summary['total_revenue'] / summary['total_orders']
-        summary = summary.merge(rest_meta, on='restaurant_id', how='left')
-        for _, row in summary.iterrows():
-            restaurants_summary_records.append({
-                'restaurant_id': int(row['restaurant_id']),
-                'name': row['name'],
-                'country': 'UK' if int(row['country_id']) == 1 else 'India',
-                'client_id': int(row['client_id']),
-                'client_name': row['client_name'] if pd.notna(row['client_name']) else '',
-                'total_orders': int(row['total_orders']),
-                'total_revenue': round(float(row['total_revenue']), 2),
-                'total_expenses': round(float(row['total_expenses']), 2),
-                'profit': round(float(row['total_revenue'] - row['total_expenses']), 2),
-                'avg_order_value': round(float(row['avg_order_value']), 2)
+            # Restaurant-level summary across selected period (full year here)
+            print("📊 Building restaurant summary...")
+            restaurants_summary_records = _records({
+                'restaurant_id': _int_column(summary['restaurant_id']),
+                'name': summary['name'],
+                'country': _country_names(_int_column(summary['country_id'])),
+                'client_id': _int_column(summary['client_id']),
+                'client_name': _text_column(summary['client_name']),
+                'total_orders': _int_column(summary['total_orders']),
+                'total_revenue': _money(summary['total_revenue']),
+                'total_expenses': _money(summary['total_expenses']),
+                'profit': _money(summary['total_revenue'] - summary['total_expenses']),
+                'avg_order_value': _money(summary['avg_order_value'])
             })
-        
-        print(f"✅ Successfully built {len(per_restaurant_daily_records)} daily records and {len(restaurants_summary_records)} summary records")
 
-    except Exception as e:
-        print(f"❌ Error building per-restaurant daily dataset: {e}")
-        print("🔄 Attempting fallback restaurant summary generation...")
-        
-        # Fallback: Generate basic restaurant summary from available data
-        try:
-            # Create basic restaurant summary from restaurants table
-            for _, restaurant in restaurants.iterrows():
-                # Get basic restaurant info
-                restaurant_id = int(restaurant['id'])
-                restaurant_name = restaurant['name']
-                country_id = int(restaurant['country_id'])
-                client_id = int(restaurant['client_id'])
-                
-                # Get client name
-                client_name = ''
-                if not clients.empty:
-                    client_row = clients[clients['client_id'] == client_id]
-                    if not client_row.empty:
-                        client_name = client_row.iloc[0]['legal_name']
-                
-                # Calculate basic metrics from orders and sales
-                total_orders = 0
-                total_revenue = 0.0
-                total_expenses = 0.0
-                
-                # Orders for this restaurant
-                if not orders.empty:
-                    restaurant_orders = orders[orders['restaurant_id'] == restaurant_id]
-                    total_orders = len(restaurant_orders)
-                
-                # Sales for this restaurant
-                if not sales.empty:
-                    restaurant_sales = sales[sales['restaurant_id'] == restaurant_id]
-                    if not restaurant_sales.empty:
-                        total_revenue = (
-                            restaurant_sales['food_payment'].sum() +
-                            restaurant_sales['drinks_payment'].sum() +
-                            restaurant_sales['other_payment'].sum() +
-                            restaurant_sales['service_charges'].sum() +
-                            restaurant_sales['delivery_charges'].sum()
-                        )
-                
-                # Expenses for this restaurant
-                if not expenses.empty:
-                    restaurant_expenses = expenses[expenses['restaurant_id'] == restaurant_id]
-                    if not restaurant_expenses.empty:
-                        total_expenses = restaurant_expenses['amount'].sum()
-                
-                # Calculate derived metrics
-                profit = total_revenue - total_expenses
-                avg_order_value = total_revenue / total_orders if total_orders > 0 else 0
-                
-                restaurants_summary_records.append({
-                    'restaurant_id': restaurant_id,
-                    'name': restaurant_name,
-                    'country': 'UK' if country_id == 1 else 'India',
-                    'client_id': client_id,
-                    'client_name': client_name,
-                    'total_orders': total_orders,
-                    'total_revenue': round(float(total_revenue), 2),
-                    'total_expenses': round(float(total_expenses), 2),
-                    'profit': round(float(profit), 2),
-                    'avg_order_value': round(float(avg_order_value), 2)
-                })
-            
-            print(f"✅ Generated fallback restaurant summary for {len(restaurants_summary_records)} restaurants")
-            
-        except Exception as e2:
-            print(f"❌ Fallback restaurant summary generation also failed: {e2}")
-            # Create minimal restaurant summary from just the restaurants table
-            for _, restaurant in restaurants.iterrows():
-                restaurants_summary_records.append({
-                    'restaurant_id': int(restaurant['id']),
-                    'name': restaurant['name'],
-                    'country': 'UK' if int(restaurant['country_id']) == 1 else 'India',
-                    'client_id': int(restaurant['client_id']),
-                    'client_name': '',
-                    'total_orders': 0,
-                    'total_revenue': 0.0,
-                    'total_expenses': 0.0,
-                    'profit': 0.0,
-                    'avg_order_value': 0.0
-                })
-            print(f"✅ Created minimal restaurant summary for {len(restaurants_summary_records)} restaurants")
-    
+            print(f"✅ Successfully built {len(per_restaurant_daily_records)} daily records and {len(restaurants_summary_records)} summary records")
+
+        except Exception as e:
+            print(f"❌ Error building per-restaurant daily dataset: {e}")
+            print("🔄 Attempting fallback restaurant summary generation...")
+
+            # Fallback: restaurant totals from one grouped aggregation per table
+            try:
+                restaurants_summary_records = _fallback_restaurant_summary(restaurants, clients, order_aggs, sales, expenses)
+                print(f"✅ Generated fallback restaurant summary for {len(restaurants_summary_records)} restaurants")
+
+            except Exception as e2:
+                print(f"❌ Fallback restaurant summary generation also failed: {e2}")
+                # Create minimal restaurant summary from just the restaurants table
+                restaurants_summary_records = _fallback_restaurant_summary(restaurants)
+                print(f"✅ Created minimal restaurant summary for {len(restaurants_summary_records)} restaurants")
+        span.rows_out = len(per_restaurant_daily_records) + len(restaurants_summary_records)
+    metrics['per_restaurant_daily'] = per_restaurant_daily_records
+    metrics['restaurants_summary'] = restaurants_summary_records
+
+
+@analysis_stage('reconciliation', columns={'cashup': ['restaurant_id', 'cash_up_date', 'is_match']},
+                outputs=('reconciliation_daily', 'reconciliation_daily_columns', 'reconciliation_rate'))
+def _reconciliation_stage(tables, metrics, context):
+    cashup = tables['cashup']
     # Build reconciliation per day (for filter-based KPI)
-    print("🔄 Building reconciliation data...")
-    cashup_copy = cashup.copy()
-    cashup_copy['cash_up_date'] = pd.to_datetime(cashup_copy['cash_up_date'], errors='coerce').dt.date
-    reconciliation_daily = cashup_copy[['restaurant_id', 'cash_up_date', 'is_match']].rename(
-        columns={'cash_up_date': 'date'}
-    )
-    metrics['reconciliation_daily'] = [
-        {
-            'restaurant_id': int(row['restaurant_id']),
-            'date': str(row['date']),
-            'is_match': bool(row['is_match'])
+    with PROFILER.span('reconciliation', rows_in=len(cashup)) as span:
+        print("🔄 Building reconciliation data...")
+        reconciliation_columns = {
+            'restaurant_id': _int_column(cashup['restaurant_id']),
+            'day': cashup['cash_up_date'].array,
+            'is_match': cashup['is_match'].astype(bool).to_numpy()
         }
-        for _, row in reconciliation_daily.iterrows()
-    ]
+        metrics['reconciliation_daily'] = ColumnRecords(_with_iso_dates(reconciliation_columns))
+        metrics['reconciliation_daily_columns'] = reconciliation_columns
+        if not cashup.empty:
+            matched_cashups = len(cashup[cashup['is_match'] == True])
+            metrics['reconciliation_rate'] = round((matched_cashups / len(cashup)) * 100, 2)
+        span.rows_out = len(metrics['reconciliation_daily'])
+
 
+@analysis_stage('profitability', after=('sales', 'expenses'),
+                outputs=('net_profit', 'profit_margin'))
+def _profitability_stage(tables, metrics, context):
     # 8. Profitability analysis
-    if 'total_revenue' in metrics and 'total_expenses' in metrics:
-        net_profit = metrics['total_revenue'] - metrics['total_expenses']
-        metrics['net_profit'] = round(net_profit, 2)
-        metrics['profit_margin'] = round((net_profit / metrics['total_revenue']) * 100, 2)
-    
-    # 9. Cash flow and reconciliation analysis
-    if not cashup.empty:
-        total_cashups = len(cashup)
-        matched_cashups = len(cashup[cashup['is_match'] == True])
-        metrics['reconciliation_rate'] = round((matched_cashups / total_cashups) * 100, 2)
-        
-        # Banking efficiency
-        if not banking.empty:
-            merged_banking = pd.merge(cashup, banking, on='banking_id', how='inner')
-            if not merged_banking.empty:
-                banking_variances = abs(merged_banking['eod_amount'] - merged_banking['banking_total'])
-                metrics['avg_banking_variance'] = round(banking_variances.mean(), 2)
-                metrics['max_banking_variance'] = round(banking_variances.max(), 2)
-    
+    with PROFILER.span('profitability', rows_in=_metric_values(metrics, ('total_revenue', 'total_expenses'))) as span:
+        if 'total_revenue' in metrics and 'total_expenses' in metrics:
+            net_profit = metrics['total_revenue'] - metrics['total_expenses']
+            metrics['net_profit'] = round(net_profit, 2)
+            metrics['profit_margin'] = round((net_profit / metrics['total_revenue']) * 100, 2)
+        span.rows_out = _metric_values(metrics, ANALYSIS_STAGES['profitability'].outputs)
+
+
+@analysis_stage('banking',
+                columns={'cashup': ['restaurant_id', 'cash_up_date', 'eod_amount', 'is_match', 'banking_id'],
+                         'banking': ['banking_id', 'banking_total', 'banked_total']},
+                outputs=('avg_banking_variance', 'max_banking_variance', 'banking_variance_daily',
+                         'banking_variance_daily_columns', 'banking_anomalies'))
+def _banking_stage(tables, metrics, context):
+    cashup, banking = tables['cashup'], tables['banking']
+    # 9. Cash flow: banking variance (the reconciliation rate is built with the daily reconciliation)
+    with PROFILER.span('banking_merge', rows_in=len(cashup) + len(banking)) as span:
+        span.rows_out = 0
+        if not cashup.empty:
+            # Banking efficiency
+            if not banking.empty:
+                merged_banking = pd.merge(cashup, banking, on='banking_id', how='inner')
+                span.rows_out = len(merged_banking)
+                if not merged_banking.empty:
+                    banking_variances = abs(merged_banking['eod_amount'] - merged_banking['banking_total'])
+                    metrics['avg_banking_variance'] = round(banking_variances.mean(), 2)
+                    metrics['max_banking_variance'] = round(banking_variances.max(), 2)
+
+                    # per restaurant-day series with anomaly flags
+                    with PROFILER.span('banking_anomalies', rows_in=len(merged_banking)) as series_span:
+                        series = build_banking_variance(merged_banking)
+                        variance_columns = {
+                            'restaurant_id': _int_column(series['restaurant_id']),
+                            'day': series['day'].to_numpy(dtype='int32'),
+                            'variance': _money(series['variance']),
+                            'banked_variance': _money(series['banked_variance']),
+                            'zscore': _nullable_column(np.round(series['zscore'], 2)),
+                            'banked_zscore': _nullable_column(np.round(series['banked_zscore'], 2)),
+                            'unmatched_streak': series['unmatched_streak'].to_numpy(dtype='int32'),
+                            'anomaly': series['anomaly'].to_numpy()
+                        }
+                        metrics['banking_variance_daily'] = ColumnRecords(_with_iso_dates(variance_columns))
+                        metrics['banking_variance_daily_columns'] = variance_columns
+                        flagged = series[series['anomaly'] > 0]
+                        metrics['banking_anomalies'] = _records({
+                            'restaurant_id': _int_column(flagged['restaurant_id']),
+                            'date': _iso_dates(flagged['day'].to_numpy(dtype='int32')),
+                            'variance': _money(flagged['variance']),
+                            'banked_variance': _money(flagged['banked_variance']),
+                            'zscore': _nullable_column(np.round(flagged['zscore'], 2)),
+                            'banked_zscore': _nullable_column(np.round(flagged['banked_zscore'], 2)),
+                            'unmatched_streak': flagged['unmatched_streak'].to_numpy(dtype='int64'),
+                            'zscore_outlier': (flagged['anomaly'] & ANOMALY_ZSCORE) > 0,
+                            'unmatched_run': (flagged['anomaly'] & ANOMALY_STREAK) > 0
+                        })
+                        series_span.rows_out = len(flagged)
+
+
+@analysis_stage('operational', columns={'users': ['user_id'], 'orders': None, 'restaurants': ['id']},
+                outputs=('avg_orders_per_staff',))
+def _operational_stage(tables, metrics, context):
+    restaurants, users, order_aggs = tables['restaurants'], tables['users'], tables['orders']
     # 10. Operational efficiency
-    if not orders.empty and not users.empty:
-        # Average orders handled per staff member across all restaurants
-        users_per_restaurant = len(users) / metrics['total_restaurants']
-        orders_per_restaurant = len(orders) / metrics['total_restaurants']
-        metrics['avg_orders_per_staff'] = round(orders_per_restaurant / users_per_restaurant, 2) if users_per_restaurant > 0 else 0
-    
+    with PROFILER.span('operational', rows_in=len(users) + len(restaurants)) as span:
+        if order_aggs.count and not users.empty:
+            # Average orders handled per staff member across all restaurants
+            users_per_restaurant = len(users) / len(restaurants)
+            orders_per_restaurant = order_aggs.count / len(restaurants)
+            metrics['avg_orders_per_staff'] = round(orders_per_restaurant / users_per_restaurant, 2) if users_per_restaurant > 0 else 0
+        span.rows_out = _metric_values(metrics, ANALYSIS_STAGES['operational'].outputs)
+
+
+@analysis_stage('performance_ranking', columns={'orders': None, 'restaurants': ['id', 'name', 'country_id']},
+                outputs=('restaurant_performance', 'restaurant_order_totals'))
+def _performance_ranking_stage(tables, metrics, context):
+    restaurants, order_aggs = tables['restaurants'], tables['orders']
     # 11. Restaurant performance (top performers using FULL orders)
-    restaurant_performance = []
-    if not orders.empty:
-        agg = orders.groupby('restaurant_id').agg(
-            total_orders=('order_id', 'count'),
-            total_revenue=('order_total', 'sum')
-        ).reset_index()
-        agg = agg.sort_values('total_revenue', ascending=False).head(10)
-        merged = agg.merge(restaurants[['id', 'name', 'country_id']], left_on='restaurant_id', right_on='id', how='left')
-        for _, row in merged.iterrows():
-            restaurant_performance.append({
-                'name': row['name'],
-                'country': 'UK' if row['country_id'] == 1 else 'India',
-                'daily_orders': round(row['total_orders'] / 365.0, 1),
-                'revenue': round(row['total_revenue'], 2)
+    with PROFILER.span('performance_ranking', rows_in=len(order_aggs.restaurant_counts)) as span:
+        restaurant_performance = []
+        if order_aggs.count:
+            agg = pd.DataFrame({
+                'total_orders': order_aggs.restaurant_counts,
+                'total_revenue': order_aggs.restaurant_totals / 100
+            }).rename_axis('restaurant_id').sort_index().reset_index()
+            # every restaurant's order count and order value, for per-client rankings
+            metrics['restaurant_order_totals'] = {
+                'restaurant_id': _int_column(agg['restaurant_id']),
+                'orders': _int_column(agg['total_orders']),
+                'order_total': _money(agg['total_revenue'])
+            }
+            agg = agg.sort_values('total_revenue', ascending=False, kind='stable').head(10)
+            merged = agg.merge(restaurants[['id', 'name', 'country_id']], left_on='restaurant_id', right_on='id', how='left')
+            restaurant_performance = _records({
+                'name': merged['name'],
+                'country': _country_names(merged['country_id']),
+                'daily_orders': np.round(merged['total_orders'] / 365.0, 1),
+                'revenue': _money(merged['total_revenue'])
             })
-    metrics['restaurant_performance'] = restaurant_performance
-    metrics['per_restaurant_daily'] = per_restaurant_daily_records
-    metrics['restaurants_summary'] = restaurants_summary_records
-    
+        metrics['restaurant_performance'] = restaurant_performance
+        span.rows_out = len(restaurant_performance)
+
+
+@analysis_stage('lists',
+                columns={'clients': ['client_id', 'legal_name', 'is_active', 'subscription_id'],
+                         'subscriptions': ['subscription_id', 'subscription_name'],
+                         'restaurants': ['id', 'name', 'client_id', 'country_id']},
+                outputs=('clients_list', 'restaurants_list', 'restaurant_dimension'))
+def _lists_stage(tables, metrics, context):
+    clients, restaurants, subscriptions = tables['clients'], tables['restaurants'], tables['subscriptions']
     # Lightweight lists for filters
-    # Enrich clients list with subscription details for filter-aware charts on frontend
-    metrics['clients_list'] = [
-        {
-            'client_id': int(row['client_id']),
-            'client_name': row['legal_name'],
-            'is_active': bool(row['is_active']) if 'is_active' in row else True,
-            'subscription_id': int(row['subscription_id']) if 'subscription_id' in row and not pd.isna(row['subscription_id']) else None,
-            'subscription_name': subscription_map.get(int(row['subscription_id']), '') if 'subscription_id' in row and not pd.isna(row['subscription_id']) else ''
-        }
-        for _, row in clients.sort_values('legal_name').iterrows()
-    ]
-    metrics['restaurants_list'] = [
-        {
-            'restaurant_id': int(row['id']),
-            'name': row['name'],
-            'client_id': int(row['client_id'])
-        }
-        for _, row in restaurants[['id', 'name', 'client_id']].sort_values('name').iterrows()
-    ]
-    # users list to enable operational metrics under filters
-    metrics['users_list'] = [
-        {
-            'user_id': int(row['user_id']),
-            'client_id': int(row['client_id']) if 'client_id' in row else None,
-            'restaurant_id': int(row['restaurant_id']) if 'restaurant_id' in row else None
+    with PROFILER.span('lists', rows_in=len(clients) + len(restaurants)) as span:
+        subscription_map = dict(zip(
+            subscriptions['subscription_id'].astype('int64').tolist(),
+            subscriptions['subscription_name'].tolist()
+        ))
+        # Enrich clients list with subscription details for filter-aware charts on frontend
+        sorted_clients = clients.sort_values('legal_name')
+        client_sub_ids = sorted_clients['subscription_id'].astype(object).where(sorted_clients['subscription_id'].notna(), None)
+        metrics['clients_list'] = _records({
+            'client_id': _int_column(sorted_clients['client_id']),
+            'client_name': sorted_clients['legal_name'],
+            'is_active': sorted_clients['is_active'].astype(bool),
+            'subscription_id': [None if sid is None else int(sid) for sid in client_sub_ids],
+            'subscription_name': client_sub_ids.map(lambda sid: '' if sid is None else subscription_map.get(int(sid), ''))
+        })
+        sorted_restaurants = restaurants[['id', 'name', 'client_id']].sort_values('name')
+        metrics['restaurants_list'] = _records({
+            'restaurant_id': _int_column(sorted_restaurants['id']),
+            'name': sorted_restaurants['name'],
+            'client_id': _int_column(sorted_restaurants['client_id'])
+        })
+
+        # Restaurant metadata (with client name) stored once for the columnar output
+        rest_dim = restaurants[['id', 'name', 'country_id', 'client_id']].merge(
+            clients[['client_id', 'legal_name']], on='client_id', how='left'
+        )
+        metrics['restaurant_dimension'] = {
+            'restaurant_id': _int_column(rest_dim['id']),
+            'name': _nullable_column(rest_dim['name']),
+            'country': _country_names(rest_dim['country_id']),
+            'client_id': _nullable_column(rest_dim['client_id']),
+            'client_name': _text_column(rest_dim['legal_name'])
         }
-        for _, row in users[['user_id', 'client_id', 'restaurant_id']].iterrows()
-    ]
+        span.rows_out = len(metrics['clients_list']) + len(metrics['restaurants_list'])
+
+
+@analysis_stage('users', columns={'users': ['user_id', 'client_id', 'restaurant_id']},
+                outputs=('total_users', 'users_list'))
+def _users_stage(tables, metrics, context):
+    users = tables['users']
+    with PROFILER.span('users', rows_in=len(users)) as span:
+        metrics['total_users'] = len(users)
+        # users list to enable operational metrics under filters
+        metrics['users_list'] = _records({
+            'user_id': _int_column(users['user_id']),
+            'client_id': _int_column(users['client_id']),
+            'restaurant_id': _int_column(users['restaurant_id'])
+        })
+        span.rows_out = len(metrics['users_list'])
+
+
+def analyze_tables(tables, workers=None, metrics=None, stages=None):
+    """Calculate key metrics from load_ros_tables() output with integrated fixes.
+
+    With `stages` only those stages run (their tables must be loaded); passing `metrics`
+    as well re-runs them in place.
+    """
+
+    workers = WORKERS if workers is None else workers
+    stages = list(ANALYSIS_STAGES) if stages is None else [name for name in ANALYSIS_STAGES if name in stages]
+    order_aggs, sales, expenses = tables.get('orders'), tables.get('sales'), tables.get('expenses')
+    context = {}
+
+    # Per-restaurant pipeline over restaurant_id shards (--workers); 7b runs it in-process otherwise
+    if workers > 1 and 'daily_dataset' in stages:
+        with PROFILER.span('restaurant_shards', rows_in=len(sales) + len(expenses)) as span:
+            print(f"🧩 Aggregating {workers} restaurant shards in parallel...")
+            rest_meta = _restaurant_meta(tables['restaurants'], tables['clients'])
+            raw_orders = isinstance(order_aggs, pd.DataFrame)
+            try:
+                sharded_aggs, context['restaurant_days'] = aggregate_by_restaurant(
+                    order_aggs if raw_orders else order_aggs.daily_counts, sales, expenses, rest_meta, workers
+                )
+                if raw_orders:
+                    order_aggs = sharded_aggs
+            except Exception as e:
+                print(f"⚠️ Sharded aggregation failed, continuing in one process: {e}")
+                if raw_orders:
+                    order_aggs = OrderAggregates.from_frame(order_aggs)
+            span.rows_out = sum(len(part) for part in context.get('restaurant_days', ()))
+    elif isinstance(order_aggs, pd.DataFrame):
+        order_aggs = OrderAggregates.from_frame(order_aggs)
+    if order_aggs is not None:
+        # keep only the aggregates so a session doesn't hold the raw orders
+        tables['orders'] = order_aggs
+
+    if metrics is None:
+        print("✅ Data files loaded successfully")
+        if order_aggs is not None and sales is not None and expenses is not None:
+            print(f"📊 Loaded: {order_aggs.count} orders, {len(sales)} sales, {len(expenses)} expenses")
+        metrics = {}
+
+    # Calculate key metrics; a re-run stage first drops what it wrote last time
+    for name in stages:
+        stage = ANALYSIS_STAGES[name]
+        for key in stage.outputs:
+            metrics.pop(key, None)
+        stage.func(tables, metrics, context)
     
     return metrics
 
-def generate_dashboard_data():
-    """Generate data for dashboard consumption"""
+
+def load_and_analyze_data(incremental=None, workers=None):
+    """Load CSV files and calculate key metrics with integrated fixes"""
+    rejects = {}
+    tables = load_ros_tables(incremental, workers, rejects=rejects)
+    return None if tables is None else analyze_tables(validate_loaded_tables(tables, rejects=rejects), workers)
+
+
+def compute_metrics(names, workers=None):
+    """Only the named metrics (a stage name gives all of its metrics), loading just the
+    tables and columns they read; None if the files can't be read"""
+    stages, columns = metric_plan(names)
+    rejects = {}
+    tables = load_ros_tables(workers=workers, columns=columns, rejects=rejects)
+    if tables is None:
+        return None
+    metrics = analyze_tables(validate_loaded_tables(tables, columns, rejects=rejects), workers, stages=stages)
+    keys = [key for name in names for key in (ANALYSIS_STAGES[name].outputs if name in ANALYSIS_STAGES else (name,))]
+    return {key: metrics[key] for key in dict.fromkeys(keys) if key in metrics}
+
+
+# Dashboard output formats: 'records' is the original array-of-objects layout (the
+# default, which existing consumers read), 'columnar' (format_version 2, opt in with
+# --format columnar) stores the per restaurant-day sections as struct-of-arrays with
+# restaurant/client/date values dictionary-encoded.
+DASHBOARD_FORMAT = 'records'
+DASHBOARD_FORMAT_VERSION = 2
+DASHBOARD_COMPRESS = ()
+
+
+def _nullable_column(values):
+    """Object column with missing values as None (JSON null)"""
+    s = pd.Series(values).astype(object)
+    return s.where(s.notna(), None).to_numpy()
+
+
+def encode_columnar_sections(metrics):
+    """Columnar (format v2) encoding of the per restaurant-day sections.
+
+    Restaurant and client metadata live once under 'dimensions' and rows
+    reference them (and the sorted list of ISO dates) by index.
+    """
+    rest_dim = metrics.get('restaurant_dimension') or {
+        'restaurant_id': np.array([], dtype='int64'), 'name': [], 'country': [], 'client_id': [], 'client_name': []
+    }
+    daily = metrics.get('per_restaurant_daily_columns') or {
+        'restaurant_id': np.array([], dtype='int64'), 'day': np.array([], dtype='int32')
+    }
+    recon = metrics.get('reconciliation_daily_columns') or {
+        'restaurant_id': np.array([], dtype='int64'), 'day': np.array([], dtype='int32'), 'is_match': np.array([], dtype=bool)
+    }
+    variance = metrics.get('banking_variance_daily_columns') or {
+        'restaurant_id': np.array([], dtype='int64'), 'day': np.array([], dtype='int32')
+    }
+
+    # Restaurants referenced by rows but missing from restaurants.csv get empty metadata
+    known_ids = np.asarray(rest_dim['restaurant_id'], dtype='int64')
+    referenced = np.concatenate([np.asarray(daily['restaurant_id'], dtype='int64'),
+                                 np.asarray(recon['restaurant_id'], dtype='int64'),
+                                 np.asarray(variance['restaurant_id'], dtype='int64')])
+    extra_ids = np.setdiff1d(referenced, known_ids)
+    restaurant_ids = np.concatenate([known_ids, extra_ids])
+    pad = [None] * len(extra_ids)
+
+    # One client entry per distinct client_id referenced by a restaurant
+    rest_client_ids = pd.Series(list(rest_dim['client_id']) + pad, dtype=object)
+    clients_dim = pd.DataFrame({
+        'client_id': rest_client_ids,
+        'client_name': list(rest_dim['client_name']) + [''] * len(extra_ids)
+    }).dropna(subset=['client_id']).drop_duplicates('client_id')
+    client_index = pd.Series(np.arange(len(clients_dim)), index=clients_dim['client_id'].to_numpy())
+    rest_client = rest_client_ids.map(client_index)
+
+    def restaurant_index(ids):
+        order = np.argsort(restaurant_ids, kind='stable')
+        return order[np.searchsorted(restaurant_ids, np.asarray(ids, dtype='int64'), sorter=order)]
+
+    # Distinct day keys in sorted order; only those are formatted as ISO dates
+    date_index, days = pd.factorize(
+        pd.concat([pd.Series(daily['day'], dtype='Int32'), pd.Series(recon['day'], dtype='Int32'),
+                   pd.Series(variance['day'], dtype='Int32')], ignore_index=True),
+        sort=True, use_na_sentinel=False
+    )
+    dates = _iso_dates(days)
+    n_daily = len(daily['restaurant_id'])
+    n_recon = len(recon['restaurant_id'])
+
+    daily_section = {'restaurant': restaurant_index(daily['restaurant_id']), 'date': date_index[:n_daily]}
+    for col in ['orders'] + DAILY_AMOUNT_COLUMNS + REVENUE_CATEGORY_COLUMNS + EXPENSE_CATEGORY_COLUMNS:
+        daily_section[col] = np.asarray(daily.get(col, []))
+
+    return {
+        'dimensions': {
+            'dates': dates,
+            'restaurants': {
+                'restaurant_id': restaurant_ids,
+                'name': np.asarray(list(rest_dim['name']) + pad, dtype=object),
+                'country': np.asarray(list(rest_dim['country']) + pad, dtype=object),
+                'client': _nullable_column(rest_client.astype('Int64'))
+            },
+            'clients': {
+                'client_id': clients_dim['client_id'].astype('int64').to_numpy(),
+                'client_name': clients_dim['client_name'].to_numpy()
+            }
+        },
+        'per_restaurant_daily': daily_section,
+        'reconciliation_daily': {
+            'restaurant': restaurant_index(recon['restaurant_id']),
+            'date': date_index[n_daily:n_daily + n_recon],
+            'is_match': np.asarray(recon['is_match'], dtype='int8')
+        },
+        'banking_variance_daily': {
+            'restaurant': restaurant_index(variance['restaurant_id']),
+            'date': date_index[n_daily + n_recon:],
+            **{col: values for col, values in variance.items() if col not in ('restaurant_id', 'day')}
+        }
+    }
+
+# Rollup cube: pre-aggregated totals for the dashboard's common filter combinations
+CUBE_GRAINS = {
+    'restaurant': ['week', 'month', 'quarter'],
+    'client': ['day', 'week', 'month']
+}
+_PERIOD_FREQ = {'week': 'W-SUN', 'month': 'M', 'quarter': 'Q'}
+
+
+def build_rollup_cube(metrics):
+    """Restaurant x {week, month, quarter} and client x {day, week, month} rollups.
+
+    Each grain is columnar: key ids, period start/end (ISO, inclusive), orders,
+    revenue, expenses, profit, the revenue/expense categories and the
+    reconciliation matched/total counts. Rows with no client keep client_id null
+    so the client grains still add up to the overall totals.
+    """
+    value_cols = ['orders'] + DAILY_AMOUNT_COLUMNS + REVENUE_CATEGORY_COLUMNS + EXPENSE_CATEGORY_COLUMNS
+    daily_cols = metrics.get('per_restaurant_daily_columns') or {}
+    daily = pd.DataFrame({col: daily_cols[col] for col in ['restaurant_id', 'client_id', 'day'] + value_cols
+                          if col in daily_cols})
+    recon_cols = metrics.get('reconciliation_daily_columns') or {}
+    recon = pd.DataFrame({col: recon_cols.get(col, []) for col in ['restaurant_id', 'day', 'is_match']})
+    rest_dim = metrics.get('restaurant_dimension') or {}
+    rest_client = pd.Series(list(rest_dim.get('client_id', [])),
+                            index=list(rest_dim.get('restaurant_id', [])), dtype='Int64')
+    if daily.empty and recon.empty:
+        return {}
+
+    if daily.empty:
+        daily = pd.DataFrame({col: pd.Series(dtype='float64') for col in value_cols})
+        daily['restaurant_id'] = pd.Series(dtype='int64')
+        daily['day'] = pd.Series(dtype='int32')
+    else:
+        daily = daily.drop(columns=['client_id'], errors='ignore')
+    recon = pd.DataFrame({
+        'restaurant_id': recon['restaurant_id'],
+        'day': recon['day'],
+        'recon_matched': recon['is_match'].astype('int64'),
+        'recon_total': 1
+    })
+
+    facts = pd.concat([daily, recon], ignore_index=True)
+    for col in value_cols + ['recon_matched', 'recon_total']:
+        facts[col] = facts[col].fillna(0)
+    facts['client_id'] = facts['restaurant_id'].map(rest_client).astype('Int64')
+    facts = facts[facts['day'].notna()]
+    days = facts['day'].to_numpy(dtype='int64')
+    dates = pd.Series(days.astype('datetime64[D]'), index=facts.index)
+
+    def period_bounds(grain):
+        """Inclusive first/last day keys of each row's period"""
+        if grain == 'day':
+            return days, days
+        periods = dates.dt.to_period(_PERIOD_FREQ[grain])
+        return _day_keys(periods.dt.start_time), _day_keys(periods.dt.end_time)
+
+    cube = {}
+    sum_cols = value_cols + ['recon_matched', 'recon_total']
+    for level, grains in CUBE_GRAINS.items():
+        keys = ['restaurant_id', 'client_id'] if level == 'restaurant' else ['client_id']
+        for grain in grains:
+            start, end = period_bounds(grain)
+            grouped = (
+                facts.assign(start=start, end=end)
+                .groupby(keys + ['start', 'end'], dropna=False)[sum_cols].sum()
+                .reset_index()
+            )
+            section = {key: _nullable_column(grouped[key]) for key in keys}
+            section['start'] = _iso_dates(grouped['start'])
+            section['end'] = _iso_dates(grouped['end'])
+            for col in sum_cols:
+                if col in ('orders', 'recon_matched', 'recon_total'):
+                    section[col] = grouped[col].astype('int64').to_numpy()
+                else:
+                    section[col] = _money(grouped[col])
+            cube[f'{level}_{grain}'] = section
+    return cube
+
+
+def generate_dashboard_data(output_format=None, metrics=None, client_id=None):
+    """Generate data for dashboard consumption (only one client's slice when client_id is given)"""
     
-    metrics = load_and_analyze_data()
+    output_format = output_format or DASHBOARD_FORMAT
+    if metrics is None:
+        metrics = load_and_analyze_data()
     if not metrics:
         return None
+    if client_id is not None:
+        from ros_client_shards import client_metrics
+        metrics = client_metrics(metrics, client_id)
     
     # Create dashboard-ready data structure
     dashboard_data = {
@@ -633,43 +2024,326 @@ def generate_dashboard_data():
             'banking_variance': metrics.get('avg_banking_variance', 0)
         },
         'restaurant_performance': metrics.get('restaurant_performance', []),
+        'order_value_distribution': metrics.get('order_value_distribution', {}),
         'subscription_utilization': metrics.get('subscription_analysis', []),
         'per_restaurant_daily': metrics.get('per_restaurant_daily', []),
         'restaurants_summary': metrics.get('restaurants_summary', []),
         'clients_list': metrics.get('clients_list', []),
         'restaurants_list': metrics.get('restaurants_list', []),
         'reconciliation_daily': metrics.get('reconciliation_daily', []),
+        'banking_variance_daily': metrics.get('banking_variance_daily', []),
+        'banking_anomalies': metrics.get('banking_anomalies', []),
         'users_list': metrics.get('users_list', []),
         'client_subscription_utilization': metrics.get('client_subscription_utilization', [])
     }
-    
-    # Convert numpy types to native Python types for JSON serialization
-    def convert_numpy_types(obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        elif isinstance(obj, np.floating):
-            return float(obj)
-        elif isinstance(obj, np.ndarray):
-            return obj.tolist()
-        elif isinstance(obj, dict):
-            return {key: convert_numpy_types(value) for key, value in obj.items()}
-        elif isinstance(obj, list):
-            return [convert_numpy_types(item) for item in obj]
-        return obj
-    
-    dashboard_data = convert_numpy_types(dashboard_data)
+    with PROFILER.span('rollup_cube', rows_in=len(dashboard_data['per_restaurant_daily'])) as span:
+        dashboard_data['rollup_cube'] = build_rollup_cube(metrics)
+        span.rows_out = sum(_section_rows(section) for section in dashboard_data['rollup_cube'].values())
+    if output_format == 'columnar':
+        dashboard_data['format_version'] = DASHBOARD_FORMAT_VERSION
+        per_day = ('per_restaurant_daily', 'reconciliation_daily', 'banking_variance_daily')
+        with PROFILER.span('columnar_encoding', rows_in=sum(_section_rows(dashboard_data[key]) for key in per_day)) as span:
+            dashboard_data.update(encode_columnar_sections(metrics))
+            span.rows_out = sum(_section_rows(dashboard_data[key]) for key in per_day)
+
+    # numpy arrays/scalars are left as-is; the JSON writer encodes them directly
     return dashboard_data
 
-def check_subscription_data():
+
+class DataSession:
+    """One run's tables, loaded once, with the metrics and dashboard built from them memoized"""
+
+    def __init__(self, incremental=None, workers=None):
+        self.incremental = incremental
+        self.workers = workers
+        self._loaded = None
+        self._rejects = {}
+        self._tables = None
+        self._metrics = None
+        self._dashboards = {}
+        self._dense = None
+
+    @property
+    def tables(self):
+        """All CSV_FILES tables (orders as OrderAggregates), validated; None if loading failed"""
+        if self._tables is None:
+            # the tables as loaded are kept so a refresh re-validates from the source rows
+            self._rejects = {}
+            self._loaded = load_ros_tables(self.incremental, self.workers, rejects=self._rejects) or {}
+            self._tables = validate_loaded_tables(self._loaded, rejects=self._rejects) if self._loaded else {}
+        return self._tables or None
+
+    def table(self, name):
+        """One loaded table; falls back to reading it alone if the full load failed"""
+        tables = self.tables
+        return tables[name] if tables else load_table(name)
+
+    def metrics(self):
+        if self._metrics is None and self.tables:
+            self._metrics = analyze_tables(self.tables, self.workers)
+            # raw orders were folded into aggregates; don't hold them twice
+            self._loaded['orders'] = self._tables['orders']
+        return self._metrics
+
+    def dashboard(self, output_format=None):
+        output_format = output_format or DASHBOARD_FORMAT
+        if output_format not in self._dashboards:
+            metrics = self.metrics()
+            if not metrics:
+                return None
+            self._dashboards[output_format] = generate_dashboard_data(output_format, metrics=metrics)
+        return self._dashboards[output_format]
+
+    def dense_facts(self):
+        """Restaurants × days matrices with prefix sums for constant-time range totals"""
+        if self._dense is None and self.metrics():
+            with PROFILER.span('dense_facts', rows_in=len(self.metrics()['per_restaurant_daily'])) as span:
+                self._dense = DenseFacts.from_metrics(self.metrics())
+                span.rows_out = len(self._dense.restaurant_ids) * self._dense.n_days
+        return self._dense
+
+    def refresh(self, changed_tables):
+        """Reload changed tables and re-run only the stages that depend on them; returns those stages"""
+        if self._metrics is None:
+            # nothing analyzed yet, so the next full load picks the change up
+            self._tables = None
+            return list(ANALYSIS_STAGES) if self.metrics() else []
+        state = IncrementalState() if self.incremental else None
+        # load everything first so a file that fails to parse leaves the session untouched
+        rejects = {}
+        reloaded = {table: _load_incremental(state, table, rejects) if state else _load_for_analysis(table, rejects)
+                    for table in changed_tables}
+        if state:
+            state.save()
+        self._loaded.update(reloaded)
+        for table in changed_tables:
+            self._rejects.pop(table, None)
+        self._rejects.update(rejects)
+        tables = validate_loaded_tables(self._loaded, rejects=self._rejects)
+        # a reload can quarantine or release rows of other tables too (say, a removed restaurant's sales)
+        changed = set(changed_tables) | {
+            name for name, df in tables.items()
+            if isinstance(df, pd.DataFrame) and not df.index.equals(self._tables[name].index)
+        }
+        self._tables = tables
+        stages = affected_stages(changed)
+        analyze_tables(self._tables, self.workers, metrics=self._metrics, stages=stages)
+        self._dashboards = {}
+        self._dense = None
+        return stages
+
+
+# JSON output: sections are encoded one at a time (orjson when installed)
+JSON_CHUNK_ROWS = 50000
+
+
+def _json_default(obj):
+    """Fallback encoder for values the JSON backend can't serialize natively"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, ColumnRecords):
+        return [row for chunk in obj.iter_chunks(JSON_CHUNK_ROWS) for row in chunk]
+    if isinstance(obj, (pd.Series, pd.api.extensions.ExtensionArray)):
+        return [None if pd.isna(value) else value for value in obj.tolist()]
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _json_dumps(obj, indent=False):
+    """UTF-8 JSON bytes for obj, compact or with 2-space indentation"""
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_json_default, option=option)
+    if indent:
+        return json.dumps(obj, indent=2, default=_json_default).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), default=_json_default).encode('utf-8')
+
+
+def _encode_section(value, indent):
+    """Yield the JSON bytes of one top-level value; row sections go out in chunks"""
+    if not isinstance(value, ColumnRecords):
+        yield _json_dumps(value, indent)
+        return
+    if not len(value):
+        yield b'[]'
+        return
+    yield b'[\n' if indent else b'['
+    for i, chunk in enumerate(value.iter_chunks(JSON_CHUNK_ROWS)):
+        if i:
+            yield b',\n' if indent else b','
+        body = _json_dumps(chunk, indent)
+        # drop the chunk's own brackets so the chunks join into one array
+        yield body[2:-2] if indent else body[1:-1]
+    yield b'\n]' if indent else b']'
+
+
+def write_dashboard_json(dashboard_data, stream, indent=False):
+    """Serialize the dashboard dict to a binary stream section by section"""
+    stream.write(b'{\n' if indent else b'{')
+    for i, (key, value) in enumerate(dashboard_data.items()):
+        if i:
+            stream.write(b',\n' if indent else b',')
+        key_bytes = _json_dumps(str(key))
+        stream.write(b'  ' + key_bytes + b': ' if indent else key_bytes + b':')
+        for part in _encode_section(value, indent):
+            # nest the section one level under the top-level object
+            stream.write(part.replace(b'\n', b'\n  ') if indent else part)
+    stream.write(b'\n}' if indent else b'}')
+
+
+class _BrotliWriter:
+    """File-like incremental brotli compressor (mirrors gzip.GzipFile's write/close)"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.compressor = brotli.Compressor(quality=9)
+
+    def write(self, data):
+        self.fileobj.write(self.compressor.process(data))
+
+    def close(self):
+        self.fileobj.write(self.compressor.finish())
+
+
+class _TeeWriter:
+    """Write the same bytes to several streams, counting them"""
+
+    def __init__(self, streams):
+        self.streams = streams
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        for stream in self.streams:
+            stream.write(data)
+
+
+def save_dashboard_data(dashboard_data, path='ros_dashboard_data.json', compress=None):
+    """Stream the dashboard JSON (plus optional .gz/.br siblings) to temp files and rename into place"""
+    compress = DASHBOARD_COMPRESS if compress is None else compress
+    indent = dashboard_data.get('format_version', 1) < 2
+
+    targets = {path: None}
+    siblings = {'gzip': path + '.gz', 'brotli': path + '.br'}
+    for method, sibling in siblings.items():
+        if method not in compress:
+            # never leave a stale compressed copy next to fresh JSON
+            if os.path.exists(sibling):
+                os.remove(sibling)
+        elif method == 'brotli' and brotli is None:
+            print("⚠️ brotli is not installed (pip install brotli); skipping .br output")
+        else:
+            targets[sibling] = method
+
+    files, writers = {}, {}
+    try:
+        for target, method in targets.items():
+            files[target] = open(target + '.tmp', 'wb')
+            if method == 'gzip':
+                writers[target] = gzip.GzipFile(filename='', mode='wb', fileobj=files[target],
+                                                compresslevel=6, mtime=0)
+            elif method == 'brotli':
+                writers[target] = _BrotliWriter(files[target])
+            else:
+                writers[target] = files[target]
+        tee = _TeeWriter(list(writers.values()))
+        # rows of the per-day sections, the bulk of the file
+        rows = sum(_section_rows(dashboard_data.get(key, []))
+                   for key in ('per_restaurant_daily', 'reconciliation_daily', 'banking_variance_daily'))
+        with PROFILER.span('serialization', rows_in=rows) as span:
+            write_dashboard_json(dashboard_data, tee, indent=indent)
+            span.rows_out = rows
+            span.set(bytes_out=tee.size)
+        for target in targets:
+            if writers[target] is not files[target]:
+                writers[target].close()
+            files[target].close()
+    except BaseException:
+        for target, f in files.items():
+            f.close()
+            os.remove(target + '.tmp')
+        raise
+
+    # rename the plain JSON last so readers see the compressed siblings updated first
+    for target in sorted(targets, key=lambda t: t == path):
+        os.replace(target + '.tmp', target)
+        if target != path:
+            print(f"🗜️ Wrote {target} ({os.path.getsize(target):,} bytes, {tee.size:,} uncompressed)")
+
+# watch mode: poll csv_data/ and re-run only the stages downstream of the changed tables
+WATCH_INTERVAL = 2.0
+
+
+def _csv_signatures():
+    """(size, mtime_ns) of each table's CSV; None when the file is missing"""
+    signatures = {}
+    for table, name in CSV_FILES.items():
+        try:
+            st = os.stat(os.path.join(DATA_DIR, name))
+            signatures[table] = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            signatures[table] = None
+    return signatures
+
+
+def watch(session, interval=None, path='ros_dashboard_data.json', on_update=None):
+    """Keep the session in memory and rewrite the dashboard whenever CSVs in DATA_DIR change.
+
+    A change is acted on once the file's size and mtime hold for one more poll, so a
+    file that is still being copied in isn't parsed half-written.
+    """
+    interval = WATCH_INTERVAL if interval is None else interval
+    seen = _csv_signatures()
+    pending = {}
+    print(f"👀 Watching {DATA_DIR}/ every {interval:g}s (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(interval)
+            current = _csv_signatures()
+            changed = [table for table in CSV_FILES if current[table] != seen[table]]
+            settled = [table for table in changed if pending.get(table) == current[table]]
+            pending = {table: current[table] for table in changed if table not in settled}
+            if not settled:
+                continue
+
+            start = time.perf_counter()
+            seen.update({table: current[table] for table in settled})
+            files = ', '.join(CSV_FILES[table] for table in settled)
+            try:
+                stages = session.refresh(settled)
+            except Exception as e:
+                print(f"⚠️ Could not reload {files}, keeping the previous data: {e}")
+                continue
+            dashboard_data = session.dashboard()
+            if not dashboard_data:
+                print(f"⚠️ No dashboard data after {files} changed")
+                continue
+            save_dashboard_data(dashboard_data, path)
+            if on_update:
+                on_update(session)
+            print(f"🔁 {files} changed: re-ran {', '.join(stages)} and rewrote '{path}' "
+                  f"in {time.perf_counter() - start:.2f}s")
+    except KeyboardInterrupt:
+        print("\n👋 Stopped watching")
+
+
+def check_subscription_data(session=None):
     """Check and display subscription data details"""
     
     print("\n" + "="*60)
     print("🔍 SUBSCRIPTION DATA ANALYSIS")
     print("="*60)
     
-    # Load CSV files
-    clients = pd.read_csv('csv_data/clients.csv')
-    subscriptions = pd.read_csv('csv_data/subscriptions.csv')
+    # Load CSV files (or reuse the run's session)
+    if session is not None:
+        clients = session.table('clients')
+        subscriptions = session.table('subscriptions')
+    else:
+        clients = load_table('clients')
+        subscriptions = load_table('subscriptions')
     
     print(f"\n📊 SUBSCRIPTION DATA STRUCTURE:")
     print(f"   • Total Clients: {len(clients)}")
@@ -702,14 +2376,14 @@ def check_subscription_data():
         clients_on_sub = clients[clients['subscription_id'] == sub['subscription_id']]
         print(f"   • {sub['subscription_name']}: {len(clients_on_sub)} clients, Max users: {sub['no_of_users']}, Cost: £{sub['cost']}")
 
-def print_analysis_report():
+def print_analysis_report(session=None):
     """Print comprehensive analysis report"""
     
     print("\n" + "="*60)
     print("🏪 ROS SYSTEM ANALYSIS REPORT")
     print("="*60)
     
-    metrics = load_and_analyze_data()
+    metrics = session.metrics() if session is not None else load_and_analyze_data()
     if not metrics:
         print("❌ Unable to generate report due to data loading issues")
         return
@@ -764,27 +2438,145 @@ def print_analysis_report():
     print("="*60)
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="ROS Data Processor")
+    parser.add_argument('command', nargs='?', choices=['report', 'serve', 'watch'], default='report',
+                        help="'report' writes ros_dashboard_data.json (default); "
+                             "'serve' answers filtered queries over HTTP on loopback; "
+                             "'watch' keeps the data in memory and rewrites the JSON when csv_data/ changes")
+    parser.add_argument('--host', default='127.0.0.1', help="serve: bind address (default: %(default)s)")
+    parser.add_argument('--port', type=int, default=8765, help="serve: port (default: %(default)s)")
+    parser.add_argument('--client-shards', metavar='DIR', nargs='?', const='ros_dashboard_clients',
+                        help="also write one pre-filtered dashboard file per client plus index.json "
+                             "(default DIR: %(const)s; built in --workers processes)")
+    parser.add_argument('--metrics', metavar='A,B,C',
+                        help="print only these metrics (or stages) as JSON, loading just the tables and columns they read")
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL,
+                        help="watch: seconds between polls of the CSV files (default: %(default)s)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="always re-parse the CSV files instead of using columnar snapshots")
+    parser.add_argument('--stream', action='store_true',
+                        help="aggregate orders.csv in fixed-size chunks with bounded memory")
+    parser.add_argument('--chunk-size', type=int, default=ORDERS_CHUNK_SIZE,
+                        help="rows per orders.csv chunk in --stream mode (default: %(default)s)")
+    parser.add_argument('--incremental', action='store_true',
+                        help=f"only process rows appended since the last run (state kept in {STATE_DIR}/)")
+    parser.add_argument('--load-workers', type=int, default=LOAD_WORKERS,
+                        help="threads used to read the CSV tables concurrently; 1 reads them in turn (default: %(default)s)")
+    parser.add_argument('--process-pool', choices=list(CSV_FILES), action='append', default=[],
+                        help="load this table in a worker process instead of a thread, e.g. orders (repeatable)")
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help="aggregate restaurant_id shards in this many processes (default: %(default)s)")
+    parser.add_argument('--format', choices=['columnar', 'records'], default=DASHBOARD_FORMAT,
+                        help="dashboard JSON layout (default: %(default)s)")
+    parser.add_argument('--compress', choices=['gzip', 'brotli'], action='append', default=[],
+                        help="also write a pre-compressed sibling of ros_dashboard_data.json (repeatable)")
+    parser.add_argument('--dense-export', metavar='OUT_NPZ',
+                        help="also write the restaurants × days metric matrices and their prefix sums (.npz)")
+    parser.add_argument('--snapshot', metavar='OUT_BIN',
+                        help="also write the per-restaurant-day facts and dimensions as a memory-mappable binary snapshot")
+    parser.add_argument('--quarantine-report', metavar='OUT_JSON', default=QUARANTINE_FILE,
+                        help="where validation writes the rows it set aside (default: %(default)s)")
+    parser.add_argument('--profile', metavar='OUT_JSON',
+                        help="record per-stage wall/CPU time, rows and memory spans to this JSON file")
+    parser.add_argument('--cprofile', metavar='OUT_PROF',
+                        help="with --profile, also dump cProfile stats of the slowest stage (view with pstats/snakeviz)")
+    parser.add_argument('--no-tracemalloc', action='store_true',
+                        help="with --profile, skip tracemalloc (RSS only, much lower overhead)")
+    args = parser.parse_args()
+    if args.profile:
+        PROFILER.enable(trace_memory=not args.no_tracemalloc, cprofile=bool(args.cprofile))
+    USE_CSV_CACHE = not args.no_cache
+    DASHBOARD_FORMAT = args.format
+    DASHBOARD_COMPRESS = tuple(args.compress)
+    INCREMENTAL = args.incremental
+    LOAD_WORKERS = args.load_workers
+    WORKERS = args.workers
+    PROCESS_POOL_TABLES = tuple(args.process_pool)
+    STREAM_ORDERS = args.stream
+    ORDERS_CHUNK_SIZE = args.chunk_size
+    QUARANTINE_FILE = args.quarantine_report
+
+    if args.metrics:
+        names = [name.strip() for name in args.metrics.split(',') if name.strip()]
+        # progress goes to stderr so stdout is just the JSON
+        with redirect_stdout(sys.stderr):
+            try:
+                selected = compute_metrics(names)
+            except ValueError as e:
+                raise SystemExit(f"❌ {e}")
+        if selected is None:
+            raise SystemExit("❌ Failed to load data for the requested metrics")
+        sys.stdout.buffer.write(_json_dumps(selected, indent=True) + b'\n')
+        raise SystemExit(0)
+
+    if args.command == 'serve':
+        from ros_api_server import serve
+        session = DataSession()
+        if not session.metrics():
+            raise SystemExit("❌ Failed to load data for the query API")
+        serve(session.metrics(), session.dashboard(), host=args.host, port=args.port, facts=session.dense_facts())
+        raise SystemExit(0)
+
+    if args.command == 'watch':
+        session = DataSession()
+        if not session.dashboard():
+            raise SystemExit("❌ Failed to load data to watch")
+        save_dashboard_data(session.dashboard())
+        print("✅ Dashboard data saved to 'ros_dashboard_data.json'")
+        def _refresh_snapshot(session):
+            write_fact_snapshot(session.metrics(), args.snapshot)
+
+        on_update = _refresh_snapshot if args.snapshot else None
+        if on_update:
+            on_update(session)
+        watch(session, args.interval, on_update=on_update)
+        raise SystemExit(0)
+
     print("🚀 Starting ROS Data Analysis...")
+
+    # Tables are loaded and analyzed once and shared by every step below
+    session = DataSession()
     
     # Check subscription data first
-    check_subscription_data()
+    check_subscription_data(session)
     
     # Generate analysis report
-    print_analysis_report()
+    print_analysis_report(session)
     
     # Generate dashboard data
-    dashboard_data = generate_dashboard_data()
+    dashboard_data = session.dashboard()
     if dashboard_data:
         # Save dashboard data to JSON file
-        with open('ros_dashboard_data.json', 'w') as f:
-            json.dump(dashboard_data, f, indent=2)
+        save_dashboard_data(dashboard_data)
         print("\n✅ Dashboard data saved to 'ros_dashboard_data.json'")
+        if args.dense_export:
+            session.dense_facts().save(args.dense_export)
+            print(f"🧮 Dense restaurant × day matrices saved to '{args.dense_export}'")
+        if args.client_shards:
+            from ros_client_shards import write_client_shards
+            with PROFILER.span('client_shards', rows_in=len(session.metrics().get('clients_list', []))) as span:
+                index = write_client_shards(session.metrics(), args.client_shards, workers=WORKERS,
+                                            output_format=DASHBOARD_FORMAT, compress=DASHBOARD_COMPRESS,
+                                            config=_pool_config())
+                span.rows_out = len(index['clients'])
+            print(f"🏢 {len(index['clients'])} client dashboards saved to '{args.client_shards}/' (see index.json)")
+        if args.snapshot:
+            with PROFILER.span('fact_snapshot', rows_in=len(session.metrics()['per_restaurant_daily'])) as span:
+                header = write_fact_snapshot(session.metrics(), args.snapshot)
+                span.rows_out = sum(table['rows'] for table in header['tables'].values())
+                span.set(bytes_out=os.path.getsize(args.snapshot))
+            print(f"📦 Fact snapshot saved to '{args.snapshot}' (open with ros_fact_snapshot.FactSnapshot)")
         print("🌐 Open 'ros_dashboard_dynamic.html' in your browser to view the dashboard!")
         
         # Test the data
         print("\n🧪 Testing the data...")
-        if dashboard_data['per_restaurant_daily']:
-            test_record = dashboard_data['per_restaurant_daily'][0]
+        daily = dashboard_data['per_restaurant_daily']
+        if isinstance(daily, dict) and len(daily['revenue']):
+            print(f"Sample record - Revenue: £{daily['revenue'][0]}, Expenses: £{daily['expenses'][0]}, Orders: {daily['orders'][0]}")
+        elif len(daily):
+            test_record = daily[0]
             print(f"Sample record - Revenue: £{test_record['revenue']}, Expenses: £{test_record['expenses']}, Orders: {test_record['orders']}")
         
         # Test subscription data
@@ -792,4 +2584,9 @@ if __name__ == "__main__":
         for client in dashboard_data['clients_list'][:3]:
             print(f"Client {client['client_id']}: {client['client_name']} - Subscription: {client['subscription_name']}")
     else:
-        print("\n❌ Failed to generate dashboard data")
\ No newline at end of file
+        print("\n❌ Failed to generate dashboard data")
+
+    if PROFILER.enabled:
+        PROFILER.save(args.profile, args.cprofile)
+        print(f"\n⏱️ Stage profile written to '{args.profile}'" + (f" (cProfile: '{args.cprofile}')" if args.cprofile else ''))
+        PROFILER.print_summary()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+ROS Dense Facts - restaurants × days matrices with summed-area tables
+Any (client or restaurant, date range) total is four array lookups per metric.
+"""
+
+import numpy as np
+
+DENSE_FORMAT_VERSION = 1
+# Money metrics are held as integer pence so every range total is exact
+MONEY_METRICS = ['revenue', 'expenses', 'profit',
+                 'food_payment', 'drinks_payment', 'other_payment', 'service_charges', 'delivery_charges',
+                 'bills', 'vendors', 'wage_advance', 'repairs', 'sundries']
+COUNT_METRICS = ['orders', 'days', 'recon_matched', 'recon_total']
+DENSE_METRICS = COUNT_METRICS + MONEY_METRICS
+
+
+class DenseFacts:
+    """One restaurants × days int64 matrix per metric plus its summed-area table.
+
+    Rows are ordered by client then restaurant_id, so each client's restaurants
+    form a contiguous block; `prefix[m][r, d]` is the total of rows < r and days < d.
+    A block of rows over a day range is then S[r1,d1] - S[r0,d1] - S[r1,d0] + S[r0,d0].
+    """
+
+    def __init__(self, restaurant_ids, client_ids, first_day, values, prefix=None):
+        self.restaurant_ids = np.asarray(restaurant_ids, dtype='int64')
+        self.client_ids = np.asarray(client_ids, dtype=object)
+        self.first_day = int(first_day)
+        self.values = values
+        self.prefix = dict(prefix or {})
+        for metric, matrix in values.items():
+            if metric in self.prefix:
+                continue
+            table = np.zeros((matrix.shape[0] + 1, matrix.shape[1] + 1), dtype='int64')
+            np.cumsum(matrix, axis=0, out=table[1:, 1:])
+            np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+            self.prefix[metric] = table
+        self.n_days = next(iter(values.values())).shape[1] if values else 0
+
+        self._row_order = np.argsort(self.restaurant_ids, kind='stable')
+        # client -> [start, end) row block; restaurants without a client are keyed None
+        self.client_blocks = {}
+        for row, client in enumerate(self.client_ids):
+            key = None if client is None else int(client)
+            start, _ = self.client_blocks.get(key, (row, row))
+            self.client_blocks[key] = (start, row + 1)
+
+    @classmethod
+    def from_metrics(cls, metrics):
+        """Build from the per-day column dicts produced by analyze_tables()"""
+        daily = metrics.get('per_restaurant_daily_columns') or {'restaurant_id': [], 'day': []}
+        recon = metrics.get('reconciliation_daily_columns') or {'restaurant_id': [], 'day': [], 'is_match': []}
+        rest_dim = metrics.get('restaurant_dimension') or {'restaurant_id': [], 'client_id': []}
+
+        daily_ids = np.asarray(daily['restaurant_id'], dtype='int64')
+        daily_days = np.asarray(daily['day'], dtype='int64')
+        recon_days = np.asarray(recon['day'], dtype=object)
+        has_day = np.array([day is not None and day == day for day in recon_days], dtype=bool)
+        recon_ids = np.asarray(recon['restaurant_id'], dtype='int64')[has_day]
+        recon_days = recon_days[has_day].astype('int64')
+        recon_match = np.asarray(recon['is_match'], dtype='int64')[has_day]
+
+        # restaurants (known or referenced) in client-block order
+        known_ids = np.asarray(rest_dim['restaurant_id'], dtype='int64')
+        clients_of = dict(zip(known_ids.tolist(), rest_dim['client_id']))
+        ids = np.unique(np.concatenate([known_ids, daily_ids, recon_ids]))
+        clients = [clients_of.get(int(rid)) for rid in ids]
+        clients = [None if client is None or client != client else int(client) for client in clients]
+        order = sorted(range(len(ids)), key=lambda i: (clients[i] is None, clients[i] or 0, ids[i]))
+        ids = ids[order]
+        clients = [clients[i] for i in order]
+
+        all_days = np.concatenate([daily_days, recon_days])
+        first_day = int(all_days.min()) if len(all_days) else 0
+        n_days = int(all_days.max()) - first_day + 1 if len(all_days) else 0
+        row_order = np.argsort(ids, kind='stable')
+
+        def rows_of(restaurant_ids):
+            return row_order[np.searchsorted(ids, restaurant_ids, sorter=row_order)]
+
+        def dense(rows, days, weights):
+            matrix = np.zeros((len(ids), n_days), dtype='int64')
+            np.add.at(matrix, (rows, days - first_day), weights)
+            return matrix
+
+        daily_rows = rows_of(daily_ids)
+        recon_rows = rows_of(recon_ids)
+        values = {
+            'orders': dense(daily_rows, daily_days, np.asarray(daily.get('orders', np.zeros(len(daily_ids))), dtype='int64')),
+            'days': dense(daily_rows, daily_days, 1),
+            'recon_matched': dense(recon_rows, recon_days, recon_match),
+            'recon_total': dense(recon_rows, recon_days, 1)
+        }
+        for metric in MONEY_METRICS:
+            pence = np.rint(np.asarray(daily.get(metric, np.zeros(len(daily_ids))), dtype='float64') * 100)
+            values[metric] = dense(daily_rows, daily_days, pence.astype('int64'))
+        return cls(ids, clients, first_day, values)
+
+    def day_columns(self, lo_day=None, hi_day=None):
+        """[start, end) column range for inclusive day keys, clipped to the matrix"""
+        start = 0 if lo_day is None else min(max(lo_day - self.first_day, 0), self.n_days)
+        end = self.n_days if hi_day is None else min(max(hi_day - self.first_day + 1, 0), self.n_days)
+        return start, max(start, end)
+
+    def rows(self, client_id=None, restaurant_id=None):
+        """Row positions matching both filters (None means no filter)"""
+        if restaurant_id is not None:
+            pos = np.searchsorted(self.restaurant_ids, restaurant_id, sorter=self._row_order)
+            if pos == len(self.restaurant_ids) or self.restaurant_ids[self._row_order[pos]] != restaurant_id:
+                return np.zeros(0, dtype='int64')
+            row = self._row_order[pos]
+            if client_id is not None and self.client_ids[row] != client_id:
+                return np.zeros(0, dtype='int64')
+            return np.array([row], dtype='int64')
+        if client_id is not None:
+            start, end = self.client_blocks.get(client_id, (0, 0))
+            return np.arange(start, end, dtype='int64')
+        return np.arange(len(self.restaurant_ids), dtype='int64')
+
+    def block_sums(self, metric, row_starts, row_ends, lo_day=None, hi_day=None):
+        """Totals of `metric` over row blocks [row_starts, row_ends) within the day range"""
+        table = self.prefix[metric]
+        c0, c1 = self.day_columns(lo_day, hi_day)
+        r0, r1 = np.asarray(row_starts), np.asarray(row_ends)
+        return table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0]
+
+    def row_sums(self, metric, rows, lo_day=None, hi_day=None):
+        rows = np.asarray(rows, dtype='int64')
+        return self.block_sums(metric, rows, rows + 1, lo_day, hi_day)
+
+    def total(self, metric, client_id=None, restaurant_id=None, lo_day=None, hi_day=None):
+        """One range total: a client or all restaurants is a single block, so O(1)"""
+        if restaurant_id is None:
+            start, end = (0, len(self.restaurant_ids)) if client_id is None else self.client_blocks.get(client_id, (0, 0))
+            return int(self.block_sums(metric, start, end, lo_day, hi_day))
+        return int(self.row_sums(metric, self.rows(client_id, restaurant_id), lo_day, hi_day).sum())
+
+    def totals(self, client_id=None, restaurant_id=None, lo_day=None, hi_day=None):
+        """Every metric's range total; money in pounds"""
+        totals = {}
+        for metric in self.prefix:
+            value = self.total(metric, client_id, restaurant_id, lo_day, hi_day)
+            totals[metric] = value / 100 if metric in MONEY_METRICS else value
+        return totals
+
+    def client_sums(self, metric, lo_day=None, hi_day=None):
+        """{client_id (None for unassigned): total} over every client block"""
+        keys = list(self.client_blocks)
+        starts = [self.client_blocks[key][0] for key in keys]
+        ends = [self.client_blocks[key][1] for key in keys]
+        return dict(zip(keys, self.block_sums(metric, starts, ends, lo_day, hi_day).tolist()))
+
+    def save(self, path):
+        """Write the matrices and their prefix tables to an uncompressed .npz"""
+        clients = np.array([-1 if client is None else client for client in self.client_ids], dtype='int64')
+        arrays = {'restaurant_ids': self.restaurant_ids, 'client_ids': clients,
+                  'meta': np.array([DENSE_FORMAT_VERSION, self.first_day, self.n_days], dtype='int64')}
+        for metric in self.values:
+            arrays[f'values_{metric}'] = self.values[metric]
+            arrays[f'prefix_{metric}'] = self.prefix[metric]
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            version, first_day, _ = data['meta'].tolist()
+            if version != DENSE_FORMAT_VERSION:
+                raise ValueError(f"{path}: dense facts version {version}, expected {DENSE_FORMAT_VERSION}")
+            clients = [None if client < 0 else int(client) for client in data['client_ids'].tolist()]
+            values = {key[len('values_'):]: data[key] for key in data.files if key.startswith('values_')}
+            prefix = {key[len('prefix_'):]: data[key] for key in data.files if key.startswith('prefix_')}
+            return cls(data['restaurant_ids'], clients, first_day, values, prefix)
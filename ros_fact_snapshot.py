@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+ROS Fact Snapshot - versioned fixed-layout binary of the per-restaurant-day facts
+A small header followed by raw little-endian column arrays. Readers np.memmap the file,
+so column access is zero-copy and processes opening the same snapshot share its pages.
+
+Layout (every offset is from the start of the file):
+    0   8 bytes   magic b'ROSFACTS'
+    8   uint32    format version
+    12  uint32    header length in bytes
+    16  JSON      header: {tables: {name: {rows, columns: {col: spec}}}, ...}
+    ... columns, each starting on a 64-byte boundary
+
+A column spec is {dtype, offset, nbytes} plus `null` for its missing-value sentinel;
+string columns are {kind: 'string', offsets: spec, data: spec} (int64 offsets into UTF-8 bytes).
+Days are int32 days since 1970-01-01 and money is float64 pounds, as in the pipeline.
+"""
+
+import os
+import json
+import time
+import struct
+from datetime import datetime
+
+import numpy as np
+
+SNAPSHOT_MAGIC = b'ROSFACTS'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_ALIGN = 64
+_PREAMBLE = struct.Struct('<8sII')
+NULL_DAY = int(np.iinfo('int32').min)
+NULL_ID = -1
+# integer columns that can be missing, and the sentinel stored for them (floats use NaN)
+COLUMN_NULLS = {'day': NULL_DAY, 'client_id': NULL_ID, 'subscription_id': NULL_ID}
+
+
+def _fixed(values, dtype, null=None):
+    """Column as a little-endian array; missing values become `null` (NaN for floats)"""
+    if null is not None:
+        values = [null if value is None or value != value else value for value in values]
+    return np.ascontiguousarray(np.asarray(values).astype(dtype, copy=False))
+
+
+def _strings(values):
+    encoded = [b'' if value is None or value != value else str(value).encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype='u1')
+
+
+def snapshot_tables(metrics):
+    """{table: {column: array, or a list for strings}} from analyze_tables() metrics"""
+    daily = metrics.get('per_restaurant_daily_columns') or {}
+    recon = metrics.get('reconciliation_daily_columns') or {}
+    variance = metrics.get('banking_variance_daily_columns')
+    rest_dim = metrics.get('restaurant_dimension') or {}
+    clients = metrics.get('clients_list') or []
+
+    tables = {}
+    tables['daily'] = {
+        'restaurant_id': _fixed(daily.get('restaurant_id', []), '<i8'),
+        'day': _fixed(daily.get('day', []), '<i4'),
+        'orders': _fixed(daily.get('orders', []), '<i8')
+    }
+    for col, values in daily.items():
+        if col not in tables['daily'] and col not in ('name', 'country', 'client_id', 'client_name'):
+            tables['daily'][col] = _fixed(values, '<f8')
+
+    recon_days = recon.get('day', [])
+    tables['reconciliation'] = {
+        'restaurant_id': _fixed(recon.get('restaurant_id', []), '<i8'),
+        'day': np.asarray(recon_days.to_numpy(dtype='int32', na_value=NULL_DAY) if hasattr(recon_days, 'to_numpy')
+                          else _fixed(recon_days, '<i4', NULL_DAY), dtype='<i4'),
+        'is_match': _fixed(recon.get('is_match', []), 'u1')
+    }
+
+    if variance:
+        tables['banking_variance'] = {
+            'restaurant_id': _fixed(variance['restaurant_id'], '<i8'),
+            'day': _fixed(variance['day'], '<i4'),
+            'variance': _fixed(variance['variance'], '<f8'),
+            'banked_variance': _fixed(variance['banked_variance'], '<f8'),
+            'zscore': _fixed(variance['zscore'], '<f8', np.nan),
+            'banked_zscore': _fixed(variance['banked_zscore'], '<f8', np.nan),
+            'unmatched_streak': _fixed(variance['unmatched_streak'], '<i4'),
+            'anomaly': _fixed(variance['anomaly'], 'i1')
+        }
+
+    tables['restaurants'] = {
+        'restaurant_id': _fixed(rest_dim.get('restaurant_id', []), '<i8'),
+        'client_id': _fixed(rest_dim.get('client_id', []), '<i8', NULL_ID),
+        'name': list(rest_dim.get('name', [])),
+        'country': list(rest_dim.get('country', [])),
+        'client_name': list(rest_dim.get('client_name', []))
+    }
+    tables['clients'] = {
+        'client_id': _fixed([c['client_id'] for c in clients], '<i8', NULL_ID),
+        'is_active': _fixed([c['is_active'] for c in clients], 'u1'),
+        'subscription_id': _fixed([c['subscription_id'] for c in clients], '<i8', NULL_ID),
+        'client_name': [c['client_name'] for c in clients],
+        'subscription_name': [c['subscription_name'] for c in clients]
+    }
+    return tables
+
+
+def _spec(array, offset):
+    return {'dtype': array.dtype.str, 'offset': offset, 'nbytes': array.nbytes}
+
+
+def write_fact_snapshot(metrics, path):
+    """Write the snapshot atomically (readers holding the old file keep their mapping)"""
+    tables = snapshot_tables(metrics)
+
+    # lay out every column first so the header can carry absolute offsets
+    blobs, layout = [], {}
+    for name, columns in tables.items():
+        layout[name] = {'rows': len(next(iter(columns.values()))), 'columns': {}}
+        for col, values in columns.items():
+            if isinstance(values, np.ndarray):
+                layout[name]['columns'][col] = {'null': COLUMN_NULLS[col]} if col in COLUMN_NULLS else {}
+                blobs.append((name, col, None, values))
+            else:
+                offsets, data = _strings(values)
+                layout[name]['columns'][col] = {'kind': 'string'}
+                blobs.append((name, col, 'offsets', offsets))
+                blobs.append((name, col, 'data', data))
+
+    header = {'version': SNAPSHOT_VERSION, 'generated_at': datetime.now().isoformat(),
+              'day_epoch': '1970-01-01', 'byte_order': 'little', 'tables': layout}
+
+    def align(n):
+        return -(-n // SNAPSHOT_ALIGN) * SNAPSHOT_ALIGN
+
+    # the header size depends on the offsets it contains, so settle them with a fixed-width guess
+    header_bytes = b''
+    while True:
+        offset = align(_PREAMBLE.size + len(header_bytes))
+        for name, col, part, array in blobs:
+            spec = _spec(array, offset)
+            column = layout[name]['columns'][col]
+            if part:
+                column[part] = spec
+            else:
+                column.update(spec)
+            offset = align(offset + array.nbytes)
+        encoded = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        if len(encoded) <= len(header_bytes):
+            header_bytes = encoded.ljust(len(header_bytes))
+            break
+        header_bytes = encoded + b' ' * 256
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for _, _, _, array in blobs:
+            f.write(b'\0' * (align(f.tell()) - f.tell()))
+            f.write(array.tobytes())
+        f.write(b'\0' * (align(f.tell()) - f.tell()))
+    os.replace(tmp_path, path)
+    return header
+
+
+class FactSnapshot:
+    """Read-only memory-mapped snapshot; columns are views into the shared mapping"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, version, header_len = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path}: not a ROS fact snapshot")
+            if version != SNAPSHOT_VERSION:
+                raise ValueError(f"{path}: snapshot version {version}, expected {SNAPSHOT_VERSION}")
+            self.header = json.loads(f.read(header_len))
+        self._map = np.memmap(path, dtype='u1', mode='r')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._map = None
+
+    @property
+    def tables(self):
+        return list(self.header['tables'])
+
+    def rows(self, table):
+        return self.header['tables'][table]['rows']
+
+    def columns(self, table):
+        return list(self.header['tables'][table]['columns'])
+
+    def _view(self, spec):
+        start = spec['offset']
+        return self._map[start:start + spec['nbytes']].view(np.dtype(spec['dtype']))
+
+    def column(self, table, name):
+        """Zero-copy array for a fixed-width column (strings come back as a list)"""
+        spec = self.header['tables'][table]['columns'][name]
+        if spec.get('kind') == 'string':
+            return self.strings(table, name)
+        return self._view(spec)
+
+    def strings(self, table, name):
+        spec = self.header['tables'][table]['columns'][name]
+        offsets, data = self._view(spec['offsets']), self._view(spec['data']).tobytes()
+        return [data[start:end].decode('utf-8') for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+    def table(self, name):
+        """{column: array or list of str} for one table"""
+        return {col: self.column(name, col) for col in self.columns(name)}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect a ROS fact snapshot")
+    parser.add_argument('path')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        snapshot = FactSnapshot(args.path)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"❌ {e}")
+    opened = time.perf_counter() - start
+    print(f"📦 {args.path}: version {snapshot.header['version']}, written {snapshot.header['generated_at']}, "
+          f"{os.path.getsize(args.path) / 2**20:.1f} MiB, opened in {opened * 1000:.2f} ms")
+    for name in snapshot.tables:
+        print(f"   • {name}: {snapshot.rows(name):,} rows - {', '.join(snapshot.columns(name))}")